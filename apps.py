@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class DjangoBulkXLSXUploadConfig(AppConfig):
+    '''
+    Solo hace falta en INSTALLED_APPS para las cargas resumibles (UploadJob)
+    '''
+    name = __name__.rpartition(".")[0]
+    verbose_name = "Django bulk XLSX upload"
+    default_auto_field = "django.db.models.BigAutoField"
@@ -0,0 +1,58 @@
+from django.db import models
+
+
+class Category(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+
+
+class Tag(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+
+
+class Product(models.Model):
+    sku = models.CharField(max_length=32, unique=True)
+    name = models.CharField(max_length=100)
+    qty = models.IntegerField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    active = models.BooleanField(default=True)
+    released = models.DateField(null=True)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    tags = models.ManyToManyField(Tag)
+    source = models.CharField(max_length=20)
+    attributes = models.JSONField(null=True)
+
+    def save(self, *args, uoms=None, sep=None, **kwargs):
+        '''
+        Camino de saveKwargs: las unidades llegan como texto separado por sep
+        '''
+        super().save(*args, **kwargs)
+        if uoms:
+            Unit.objects.bulk_create([Unit(product=self, name=name)
+                                      for name in uoms.split(sep)])
+
+
+class BulkProduct(Product):
+    '''
+    Product con el hook de saveKwargs en bloque
+    '''
+    class Meta:
+        proxy = True
+
+    @classmethod
+    def bulk_save_kwargs(cls, objs, values):
+        '''
+        Las unidades de todo el bloque en un solo bulk_create
+        '''
+        Unit.objects.bulk_create([Unit(product=obj, name=name)
+                                  for obj, value in zip(objs, values)
+                                  for name in value["uoms"]])
+
+
+class Unit(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    name = models.CharField(max_length=20)
+
+
+class Stock(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    qty = models.IntegerField()
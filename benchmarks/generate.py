@@ -0,0 +1,64 @@
+'''
+Generador de libros XLSX sintéticos para los benchmarks.
+Cada fila usa todos los tipos de Match de las reglas de run.py
+'''
+import datetime
+import os
+import sys
+
+import openpyxl
+
+CATEGORIES = 50
+TAGS = 20
+HEADER = ["sku", "name", "qty", "price", "active", "released", "category",
+          "tags", "color", "uoms", "stock"]
+
+
+def row(i):
+    return [
+        "SKU{0:07d}".format(i),
+        "Product {0}".format(i),
+        i % 100,
+        "{0}.{1:02d}".format(i % 1000, i % 100),
+        "yes" if i % 3 else "no",
+        datetime.date(2020, 1, 1) + datetime.timedelta(days=i % 1000),
+        "category{0}".format(i % CATEGORIES),
+        "tag{0},tag{1}".format(i % TAGS, (i + 7) % TAGS),
+        ("red", "green", "blue")[i % 3],
+        "unit,box",
+        i % 50,
+    ]
+
+
+def generateWorkbook(path, rows):
+    '''
+    Escribe en path un libro de rows filas de datos (en modo write_only,
+    así la memoria no depende de la cantidad de filas)
+    '''
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(HEADER)
+    for i in range(rows):
+        sheet.append(row(i))
+    workbook.save(path)
+    return path
+
+
+def workbookPath(rows, directory=None):
+    '''
+    Ruta del libro de rows filas, que se genera solo si no existe
+    '''
+    directory = directory or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "bench_{0}.xlsx".format(rows))
+    if not os.path.exists(path):
+        # Se escribe aparte para no dejar un libro a medias si se corta
+        partial = os.path.join(directory, "partial_{0}.xlsx".format(rows))
+        generateWorkbook(partial, rows)
+        os.replace(partial, path)
+    return path
+
+
+if __name__ == "__main__":
+    for rows in sys.argv[1:] or ["1000"]:
+        print(workbookPath(int(rows)))
@@ -0,0 +1,240 @@
+'''
+Benchmarks de DjangoBulkXLSXUpload.load sobre SQLite en memoria.
+
+    python benchmarks/run.py                        # 1k filas contra baseline.json
+    python benchmarks/run.py --rows 1000 100000 1000000
+    python benchmarks/run.py --scenario bulk --rows 100000
+    python benchmarks/run.py --update               # guarda los resultados como baseline
+
+Los libros se generan con generate.py en benchmarks/data (solo la primera
+vez) y cubren todos los tipos de Match y saveKwargs. Cada escenario corre en
+un proceso aparte, para medir su propio pico de RSS, y reporta filas por
+segundo, pico de RSS y consultas SQL por fila.
+Sale con código 1 si algún escenario tiene errores, no se procesa en los
+bloques esperados o empeora respecto de baseline.json: las consultas por
+fila casi no tienen tolerancia (QUERY_TOLERANCE), la memoria sí
+(--tolerance). Las filas por segundo dependen de la máquina: una baja
+solo se avisa.
+El comportamiento de las cargas se prueba en tests/
+'''
+import argparse
+import importlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARKS)
+BASELINE = os.path.join(BENCHMARKS, "baseline.json")
+# Consultas por fila de más permitidas: una consulta extra por
+# bloque de 1000 filas pasa, una por fila no
+QUERY_TOLERANCE = 0.01
+DEFAULT_TOLERANCE = 0.5
+CHUNK_SIZE = 1000
+
+# Escenario: (argumentos de DjangoBulkXLSXUpload, argumentos de load).
+# saveKwargs es el modelo de los productos: Product guarda las unidades
+# de a una fila en save(), BulkProduct con su hook bulk_save_kwargs
+SCENARIOS = {
+    "rows": ({"saveKwargs": "Product"}, {"chunk_size": CHUNK_SIZE}),
+    "rows_hook": ({"saveKwargs": "BulkProduct"}, {"chunk_size": CHUNK_SIZE}),
+    "bulk": ({"bulk_save": True, "saveKwargs": "BulkProduct"}, {"chunk_size": CHUNK_SIZE}),
+    "commit": ({"bulk_save": True, "saveKwargs": "BulkProduct"},
+               {"chunk_size": CHUNK_SIZE, "commit_every": CHUNK_SIZE}),
+    # Lectura completa con pyexcel, en transacciones de commit_every filas
+    "commit_full": ({"bulk_save": True, "saveKwargs": "BulkProduct"},
+                    {"commit_every": CHUNK_SIZE}),
+    "dry_run": ({"saveKwargs": "Product"}, {"chunk_size": CHUNK_SIZE, "dry_run": True}),
+}
+
+
+def setup():
+    '''
+    Proyecto Django mínimo con benchapp sobre SQLite en memoria.
+    Devuelve el paquete importado desde la raíz del repositorio
+    '''
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+    sys.path.insert(0, os.path.dirname(ROOT))
+    settings.configure(
+            INSTALLED_APPS = ["benchapp"],
+            DATABASES = {"default": {"ENGINE": "django.db.backends.sqlite3",
+                                     "NAME": ":memory:"}},
+            USE_TZ = False,
+            DEFAULT_AUTO_FIELD = "django.db.models.AutoField",
+            )
+    django.setup()
+    call_command("migrate", run_syncdb = True, verbosity = 0)
+    from benchapp.models import Category, Tag
+    from generate import CATEGORIES, TAGS
+    Category.objects.bulk_create([Category(name = "category{0}".format(i))
+                                  for i in range(CATEGORIES)])
+    Tag.objects.bulk_create([Tag(name = "tag{0}".format(i)) for i in range(TAGS)])
+    return importlib.import_module(os.path.basename(ROOT))
+
+
+def rules(Product = None):
+    from benchapp.models import Category, Stock, Tag
+    if Product is None:
+        from benchapp.models import Product
+    return {
+        Product: {
+            "sku": {"type": "simple", "column": "sku"},
+            "name": {"type": "simple", "column": "name"},
+            "qty": {"type": "simple", "column": "qty"},
+            "price": {"type": "simple", "column": "price"},
+            "active": {"type": "simple", "column": "active"},
+            "released": {"type": "simple", "column": "released"},
+            "category": {"type": "foreign", "column": "category",
+                         "model": Category, "remoteAttribute": "name"},
+            "tags": {"type": "manytomany", "column": "tags", "model": Tag,
+                     "remoteAttribute": "name", "separator": ","},
+            "source": {"type": "fixed", "value": "benchmark"},
+            "attributes": {"type": "array_hstore", "column": "color",
+                           "parameter": "attributes",
+                           "fields": {"color": "{{column:color}}", "origin": "xlsx"}},
+        },
+        Stock: {
+            "product": {"type": "model", "model": Product},
+            "qty": {"type": "simple", "column": "stock"},
+        },
+    }
+
+
+def runScenario(name, rows):
+    '''
+    Corre un escenario en este proceso y devuelve sus medidas
+    '''
+    from generate import workbookPath
+    path = workbookPath(rows)
+    package = setup()
+    from django.db import connection
+    from benchapp import models
+    initKwargs, loadKwargs = SCENARIOS[name]
+    initKwargs = dict(initKwargs)
+    Product = getattr(models, initKwargs.pop("saveKwargs"))
+    initKwargs["saveKwargs"] = {Product: {"column": "uoms", "nameKwarg": "uoms", "sep": ","}}
+    uploader = package.DjangoBulkXLSXUpload(rules(Product), **initKwargs)
+    queries = [0]
+    blocks = [0]
+
+    def counter(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    def progress(**state):
+        blocks[0] += 1
+
+    with open(path, "rb") as file, connection.execute_wrapper(counter):
+        start = time.perf_counter()
+        result = uploader.load(file, progress = progress, **loadKwargs)
+        seconds = time.perf_counter() - start
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    return {
+        "scenario": name,
+        "rows": rows,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(rows / seconds, 1),
+        "peak_rss_mb": round(peak, 1),
+        "queries_per_row": round(queries[0] / rows, 4),
+        "errors": len(result),
+        "blocks": blocks[0],
+    }
+
+
+def measure(name, rows):
+    '''
+    Corre el escenario en un proceso nuevo
+    '''
+    output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", name, str(rows)],
+            check = True, stdout = subprocess.PIPE, cwd = BENCHMARKS)
+    return json.loads(output.stdout.decode().strip().splitlines()[-1])
+
+
+def expectedBlocks(name, rows):
+    '''
+    Bloques en los que se procesa el escenario: de commit_every filas
+    si se pidió, si no de chunk_size
+    '''
+    loadKwargs = SCENARIOS[name][1]
+    size = loadKwargs.get("commit_every") or loadKwargs.get("chunk_size")
+    return -(-rows // size) if size else 1
+
+
+def compare(result, baseline, tolerance):
+    '''
+    Regresiones de result respecto de su baseline: (fallas, avisos)
+    '''
+    failures = []
+    warnings = []
+    if result["errors"]:
+        failures.append("{0} rows with errors".format(result["errors"]))
+    expected = expectedBlocks(result["scenario"], result["rows"])
+    if result["blocks"] != expected:
+        failures.append("{0} blocks, expected {1}".format(result["blocks"], expected))
+    if baseline is None:
+        return failures, warnings
+    if result["queries_per_row"] > baseline["queries_per_row"] + QUERY_TOLERANCE:
+        failures.append("queries/row {0} > {1}".format(
+            result["queries_per_row"], baseline["queries_per_row"]))
+    if result["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        failures.append("peak RSS {0} MB > {1} MB".format(
+            result["peak_rss_mb"], baseline["peak_rss_mb"]))
+    if result["rows_per_sec"] < baseline["rows_per_sec"] * (1 - tolerance):
+        warnings.append("rows/sec {0} < {1} (advisory)".format(
+            result["rows_per_sec"], baseline["rows_per_sec"]))
+    return failures, warnings
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "DjangoBulkXLSXUpload benchmarks")
+    parser.add_argument("--rows", type = int, nargs = "+", default = [1000])
+    parser.add_argument("--scenario", nargs = "+", choices = sorted(SCENARIOS),
+                        default = list(SCENARIOS))
+    parser.add_argument("--tolerance", type = float, default = DEFAULT_TOLERANCE,
+                        help = "Allowed fraction of memory growth and of slowdown (advisory)")
+    parser.add_argument("--update", action = "store_true",
+                        help = "Store the results in baseline.json")
+    parser.add_argument("--child", nargs = 2, help = argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        print(json.dumps(runScenario(args.child[0], int(args.child[1]))))
+        return 0
+    baselines = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as file:
+            baselines = json.load(file)
+    failed = False
+    print("{0:<12}{1:>9}{2:>12}{3:>10}{4:>13}  {5}".format(
+        "scenario", "rows", "rows/sec", "RSS MB", "queries/row", "status"))
+    for rows in args.rows:
+        for name in args.scenario:
+            result = measure(name, rows)
+            key = "{0}:{1}".format(name, rows)
+            failures, warnings = compare(result, baselines.get(key), args.tolerance)
+            status = "; ".join(failures + warnings) if failures or warnings else \
+                "ok" if key in baselines else "no baseline"
+            # Una regresión se guarda igual con --update; errores o bloques no
+            if args.update and not compare(result, None, args.tolerance)[0]:
+                baselines[key] = {field: result[field] for field in
+                                  ("rows_per_sec", "peak_rss_mb", "queries_per_row")}
+            failed = failed or bool(failures)
+            print("{0:<12}{1:>9}{2:>12}{3:>10}{4:>13}  {5}".format(
+                name, rows, result["rows_per_sec"], result["peak_rss_mb"],
+                result["queries_per_row"], status))
+    if args.update:
+        with open(BASELINE, "w") as file:
+            json.dump(baselines, file, indent = 4, sort_keys = True)
+            file.write("\n")
+    return 1 if failed and not args.update else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
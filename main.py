@@ -1,9 +1,58 @@
-from django.db import models
+from django.db import models, connections, router, transaction
+from django.db.models import Q
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.dispatch import Signal
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime, parse_time
+from django.utils.formats import get_format
+from asgiref.sync import sync_to_async
+from openpyxl.utils.datetime import from_excel
 from django.db.models.fields.related import ForeignKey
 import pyexcel
+import openpyxl
 from typing import Union, Dict
+from decimal import Decimal, InvalidOperation
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
+from functools import reduce
+from operator import or_
+from threading import Lock
+import asyncio
+import codecs
+import csv
 import datetime
-from copy import deepcopy
+import hashlib
+import inspect
+import io
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import tracemalloc
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+# Cantidad máxima de valores por consulta __in al resolver relaciones
+LOOKUP_BATCH_SIZE = 500
+# Tamaño de bloque cuando se lee en otro proceso sin chunk_size ni commit_every
+DEFAULT_CHUNK_SIZE = 1000
+# Se envía después de cada bloque procesado, con los mismos argumentos
+# que recibe progress en load: rows, errors, result y stats
+chunk_processed = Signal()
+# Classmethod del modelo que recibe los saveKwargs de todo un bloque
+BULK_SAVE_HOOK = "bulk_save_kwargs"
+# Argumentos de load que se guardan en un UploadJob
+JOB_OPTIONS = ("column_by_row", "samples", "commit_every", "max_error_rate",
+               "parse_in_process", "sheets")
 
 class DjangoBulkXLSXUpload():
     '''
@@ -11,63 +60,773 @@ class DjangoBulkXLSXUpload():
     Microsoft Excel XLSX file
     '''
 
-    def __init__(self, rules = None, saveKwargs: Union[Dict, None] = None):
+    def __init__(self, rules = None, saveKwargs: Union[Dict, None] = None,
+                 cache: Union["ForeignKeyCache", None] = None,
+                 bulk_save = False, batch_size = None,
+                 naturalKeys: Union[Dict, None] = None):
+        '''
+        - rules: Rules for each model, see loadRules
+        - saveKwargs: Extra arguments to save() by model:
+                 {Model: {"column": ..., "nameKwarg": ..., "sep": ...}}.
+                 If the model has the classmethod bulk_save_kwargs(objs,
+                 values) it is called once per block with the inserted
+                 objects and their parsed values, [{nameKwarg: [parts]}],
+                 instead of saving each object with the extra arguments.
+                 Then the model can also use bulk_save
+        - naturalKeys: Attributes that identify an existing row, by model.
+                 Ej: {Product: ("sku",)}. Those models are upserted:
+                 existing rows are updated only if a value changed
+        - cache: Optional ForeignKeyCache shared between uploads for
+                 the lookups of foreign matches
+        - bulk_save, batch_size: See loadRules
+        '''
         self.file = None
-        self.sheet = None
         self.records = []
         self.bulk_save = False
+        self.batch_size = None
+        self.dry_run = False
         # Array por modelos
         self.saved_models = {}
+        self.stats = None
+        self.keep_objects = False
+        # Hoja y reglas de la sección en proceso (None: todas)
+        self.sheetName = None
+        self.activeRules = None
+        self.rowIndex = None
         self.rules: list[UploadRule] = []
-        self.saveKwargs: Union[Dict, None] = None
+        self.saveKwargs: Union[Dict, None] = saveKwargs
+        self.naturalKeys: Union[Dict, None] = naturalKeys
+        self.cache: Union[ForeignKeyCache, None] = cache
         if rules:
-            self.loadRules(rules)
+            self.loadRules(rules, bulk_save = bulk_save, batch_size = batch_size)
 
-    def load(self, file, column_by_row = 0, samples=0):
+    def load(self, file, column_by_row = 0, samples=0, chunk_size = None,
+             commit_every = None, max_error_rate = None, workers = None,
+             parse_in_process = False, dry_run = False, progress = None,
+             reader = None, idempotent = False, keep_objects = False):
         '''
         Load a Excel file where:
             - column_by_row: Row with column names
             - samples: Quantity of samples to ignore by this function
                         after row of column names
+            - chunk_size: If given, the file is streamed with openpyxl in
+                        read-only mode and the rules run over blocks of
+                        chunk_size rows, so memory stays flat no matter
+                        the size of the file
+            - commit_every: If given, rows are processed in blocks of
+                        commit_every rows, each one inside its own
+                        transaction. A row that fails in any rule is rolled
+                        back in all of them (the block is processed again
+                        without it) and reported, the rest of the block is
+                        kept. Without commit_every nothing is rolled back:
+                        the objects kept of a row that failed in another
+                        rule are reported as errors
+            - max_error_rate: Fraction (0 to 1) of rows with errors above
+                        which the upload is aborted with UploadAborted. With
+                        commit_every the current block is rolled back and
+                        the previous ones are already committed. Without
+                        commit_every (with chunk_size or workers, in load or
+                        aload) nothing is rolled back: the current block is
+                        already written when UploadAborted is raised
+            - workers: If greater than 1, blocks are processed in a pool of
+                        threads, each one with its own database connection.
+                        Rules of the same level run at the same time and each
+                        rule converts and writes its blocks in parallel, except
+                        rules with naturalKeys, whose blocks go in order. With
+                        commit_every the unit of work is the whole block, so it
+                        stays in a single transaction, and if any rule has
+                        naturalKeys the blocks run one at a time. Errors and
+                        counts are returned in row order as in the serial
+                        mode. Needs a database with concurrent writes (not
+                        in-memory SQLite)
+            - parse_in_process: Read the workbook in a separate process, in
+                        blocks of chunk_size (or commit_every) rows
+            - dry_run: Only validate: values are converted to the type of
+                        each field and relations are looked up, but nothing
+                        is written. Every error is returned with its row and
+                        column, counts have the valid rows by model
+            - progress: Optional callable called after each block with
+                        rows (processed so far), errors (of the block),
+                        result (the UploadResult so far) and stats. The
+                        chunk_processed signal is sent with the same arguments
+            - reader: Reader of the file (XLSXReader, CSVReader,
+                        WorkbookReader for several sheets, or any Reader).
+                        By default .csv and .tsv files are read with
+                        CSVReader and the rest as a single sheet XLSX
+            - idempotent: Keep a persistent index (see RowIndex) to skip a
+                        file already loaded without errors with the same
+                        rules, reader, column_by_row and samples
+                        (result.skippedFile) and, for rules with naturalKeys,
+                        the rows whose content didn't change since they were
+                        loaded (counted as skipped). Needs this package in
+                        INSTALLED_APPS
+            - keep_objects: Keep the objects of the last block in
+                        saved_models. By default the objects of each model are
+                        released as soon as the rules that depend on them
+                        (type model) have used them
+        Rows are kept by column in RecordBlock: records (without chunk_size)
+        is a RecordBlock and rules receive its read-only Record views
+        Returns an UploadResult: the list of errors as {row, column, error}
+        with the inserted, updated and unchanged counts by model and the
+        UploadStats of the load as stats
+        '''
+        self._start(file, dry_run, keep_objects)
+        start = time.perf_counter()
+        errores = UploadResult(stats = self.stats)
+        if idempotent:
+            self.rowIndex = RowIndex(self)
+            hashValue = self._fileHash(file, reader, column_by_row, samples)
+            if self.rowIndex.seenFile(hashValue):
+                errores.skippedFile = True
+                return errores
+        check = ErrorRateCheck(max_error_rate, errores, self.rowIndex)
+        if workers is not None and workers > 1:
+            self.stats.memory = False
+        for blocks in self._sections(file, column_by_row, samples, chunk_size,
+                                     commit_every, parse_in_process, reader):
+            if workers is not None and workers > 1:
+                results = self._processParallel(blocks, workers, commit_every, check)
+            else:
+                results = (self._runChunk(records, firstRow, commit_every, check)
+                           for firstRow, records in blocks)
+            for erroresChunk, counts in results:
+                errores.extend(erroresChunk)
+                errores.addCounts(counts)
+                self.stats.seconds = time.perf_counter() - start
+                state = self._chunkDone(erroresChunk, errores)
+                if progress is not None:
+                    progress(**state)
+        if idempotent:
+            self._finishIndex(errores, hashValue)
+        self.stats.seconds = time.perf_counter() - start
+        return errores
+
+    async def aload(self, file, column_by_row = 0, samples = 0, chunk_size = None,
+                    commit_every = None, max_error_rate = None,
+                    parse_in_process = False, dry_run = False, progress = None,
+                    reader = None, idempotent = False, keep_objects = False):
+        '''
+        Async version of load, for ASGI views and async workers. Takes the
+        same arguments (without workers) and returns the same UploadResult.
+            - progress: Optional callable (or coroutine function) called after
+                        each block as in load
+        The workbook is read in the default executor, so the event loop is
+        not blocked while parsing, and rules use the async ORM methods.
+        Django has no async transactions: with commit_every each block runs
+        as in load, in a thread through sync_to_async
+        '''
+        result = None
+        async for state in self.aiterLoad(file, column_by_row, samples, chunk_size,
+                                          commit_every, max_error_rate,
+                                          parse_in_process, dry_run, reader,
+                                          idempotent, keep_objects):
+            result = state["result"]
+            if progress is not None:
+                called = progress(**state)
+                if inspect.isawaitable(called):
+                    await called
+        return result if result is not None else UploadResult(stats = self.stats)
+
+    async def aiterLoad(self, file, column_by_row = 0, samples = 0, chunk_size = None,
+                        commit_every = None, max_error_rate = None,
+                        parse_in_process = False, dry_run = False, reader = None,
+                        idempotent = False, keep_objects = False):
+        '''
+        Async generator with the progress of aload: yields a dict
+        {rows, errors, result, stats} after each block. SQL queries
+        are not counted in the stats of the async rules
+        '''
+        self._start(file, dry_run, keep_objects)
+        start = time.perf_counter()
+        errores = UploadResult(stats = self.stats)
+        loop = asyncio.get_running_loop()
+        if idempotent:
+            self.rowIndex = RowIndex(self)
+            hashValue = await loop.run_in_executor(None, self._fileHash, file, reader,
+                                                   column_by_row, samples)
+            if await sync_to_async(self.rowIndex.seenFile)(hashValue):
+                errores.skippedFile = True
+                yield {"rows": 0, "errors": [], "result": errores, "stats": self.stats}
+                return
+        check = ErrorRateCheck(max_error_rate, errores, self.rowIndex)
+        # En el executor solo se lee el archivo: el filtro de rowIndex
+        # consulta la base de datos y va por sync_to_async
+        sections = self._sections(file, column_by_row, samples, chunk_size,
+                                  commit_every, parse_in_process, reader, filter = False)
+        while True:
+            blocks = await loop.run_in_executor(None, next, sections, None)
+            if blocks is None:
+                break
+            while True:
+                block = await loop.run_in_executor(None, next, blocks, None)
+                if block is None:
+                    break
+                if self.rowIndex is not None:
+                    runs = await sync_to_async(self._filter)(block)
+                else:
+                    runs = [block]
+                for firstRow, records in runs:
+                    if commit_every and not dry_run:
+                        erroresChunk, counts = await sync_to_async(self._runChunk)(
+                                records, firstRow, True, check)
+                    else:
+                        erroresChunk, counts = await self._aprocessChunk(records, firstRow)
+                        await sync_to_async(check)(records, firstRow, erroresChunk)
+                    errores.extend(erroresChunk)
+                    errores.addCounts(counts)
+                    self.stats.seconds = time.perf_counter() - start
+                    yield self._chunkDone(erroresChunk, errores)
+        if idempotent:
+            await sync_to_async(self._finishIndex)(errores, hashValue)
+
+    def fingerprint(self):
+        '''
+        Hash of the loaded rules. A job can only be resumed
+        with the same rules it was created with
+        '''
+        signature = [self.bulk_save] + [rule.signature() for rule in self.rules]
+        return hashlib.sha256(repr(signature).encode()).hexdigest()
+
+    def createJob(self, path, **options):
+        '''
+        Create a resumable UploadJob for the file at path, which must stay
+        available until the job is done. options are the arguments of load
+        used by runJob: column_by_row, samples, commit_every (default
+        DEFAULT_CHUNK_SIZE), max_error_rate and parse_in_process, and
+        sheets, the {sheet name: [models]} of a WorkbookReader.
+        Needs this package in INSTALLED_APPS
+        '''
+        from .models import UploadJob
+        for key in options.keys():
+            if key not in JOB_OPTIONS:
+                raise Exception("{0} isn't a valid option for a job".format(key))
+        if len(self.rules) == 0:
+            raise Exception("No rules are loaded, load them first")
+        options.setdefault("commit_every", DEFAULT_CHUNK_SIZE)
+        if "sheets" in options:
+            options["sheets"] = {name: [model._meta.label for model in models]
+                                 for name, models in options["sheets"].items()}
+        with open(path, "rb") as file:
+            hashValue = fileHash(file)
+        return UploadJob.objects.create(
+                file = str(path),
+                file_hash = hashValue,
+                rules_fingerprint = self.fingerprint(),
+                options = options
+                )
+
+    def runJob(self, job, progress = None):
+        '''
+        Run (or resume) an UploadJob, or its primary key, usually from a
+        worker process. Each block of commit_every rows is written in its
+        own transaction together with its UploadJobChunk, so after a crash
+        or a deploy running the job again skips the committed blocks
+        (they are still read, but not converted nor written) and goes on
+        from the first pending one.
+            - progress: Optional callable called after each block
+                        written, as in load
+        The rules must be the same the job was created with, and the file
+        must not have changed.
+        Returns the UploadResult of the whole job, also available
+        later as job.result()
+        '''
+        from .models import UploadJob, UploadJobChunk
+        if not isinstance(job, UploadJob):
+            job = UploadJob.objects.get(pk = job)
+        if job.rules_fingerprint != self.fingerprint():
+            raise Exception("The rules don't match the ones of the job {0}".format(job.pk))
+        with open(job.file, "rb") as file:
+            if fileHash(file) != job.file_hash:
+                raise Exception("The file of the job {0} has changed".format(job.pk))
+        if job.status == UploadJob.DONE:
+            return job.result()
+        options = job.options
+        commit_every = options.get("commit_every") or DEFAULT_CHUNK_SIZE
+        self._start(job.file)
+        # Estado acumulado de los bloques ya confirmados
+        errores = job.result()
+        errores.stats = self.stats
+        start = time.perf_counter()
+        check = ErrorRateCheck(options.get("max_error_rate"), errores)
+        done = {}
+        for index, rows in job.chunks.values_list("index", "rows"):
+            done[index] = rows
+        check.processed = sum(done.values())
+        check.rows.update(x["row"] for x in errores)
+        alias = router.db_for_write(UploadJobChunk)
+        reader = None
+        if options.get("sheets"):
+            reader = WorkbookReader({name: [apps.get_model(label) for label in labels]
+                                     for name, labels in options["sheets"].items()})
+        UploadJob.objects.filter(pk = job.pk).update(status = UploadJob.RUNNING, message = "")
+        try:
+            with open(job.file, "rb") as file:
+                # Índice global de los bloques de todas las secciones
+                index = -1
+                for blocks in self._sections(file, options.get("column_by_row", 0),
+                                             options.get("samples", 0), commit_every,
+                                             commit_every, options.get("parse_in_process", False),
+                                             reader):
+                    for firstRow, records in blocks:
+                        index += 1
+                        if index in done:
+                            continue
+                        with transaction.atomic(using = alias):
+                            erroresChunk, counts = self._runChunk(records, firstRow, True, check)
+                            UploadJobChunk.objects.create(
+                                    job = job, index = index, first_row = firstRow,
+                                    rows = len(records), errors = erroresChunk,
+                                    counts = {model._meta.label: value
+                                              for model, value in counts.items()}
+                                    )
+                        errores.extend(erroresChunk)
+                        errores.addCounts(counts)
+                        self.stats.seconds = time.perf_counter() - start
+                        state = self._chunkDone(erroresChunk, errores)
+                        if progress is not None:
+                            progress(**state)
+        except Exception as e:
+            UploadJob.objects.filter(pk = job.pk).update(
+                    status = UploadJob.FAILED, message = str(e))
+            raise
+        UploadJob.objects.filter(pk = job.pk).update(status = UploadJob.DONE)
+        job.status = UploadJob.DONE
+        return errores
+
+    def _start(self, file, dry_run = False, keep_objects = False):
+        '''
+        Validaciones y estado inicial de cada carga
         '''
         if len(self.rules) == 0:
             raise Exception("No rules are loaded, load them first")
+        if self.bulk_save and not dry_run:
+            self.checkBulkSupport()
+        self.dry_run = dry_run
+        self.keep_objects = keep_objects
+        self.file = file
+        self.records = []
+        self.saved_models = {}
+        self.stats = UploadStats()
+        self.sheetName = None
+        self.activeRules = None
+        self.rowIndex = None
+
+    def _chunkDone(self, erroresChunk, result):
+        '''
+        Estado después de cada bloque para progress y chunk_processed
+        '''
+        state = {"rows": self.stats.rows, "errors": erroresChunk,
+                 "result": result, "stats": self.stats}
+        chunk_processed.send(sender = self.__class__, uploader = self, **state)
+        return state
+
+    def _fileHash(self, file, reader = None, column_by_row = 0, samples = 0):
+        '''
+        Clave de un archivo ya cargado en RowIndex: el hash del contenido
+        junto con las opciones que cambian qué filas se leen
+        '''
+        if isinstance(file, str):
+            with open(file, "rb") as opened:
+                hashValue = fileHash(opened)
+        else:
+            hashValue = fileHash(file)
+        if reader is None:
+            reader = readerFor(file)
+        options = (reader.signature() if reader is not None else None,
+                   column_by_row, samples)
+        return hashlib.sha256((hashValue + repr(options)).encode()).hexdigest()
+
+    def _finishIndex(self, result, hashValue):
+        '''
+        Cierre de una carga idempotent: conteos de filas salteadas y, si
+        no hubo errores, el archivo queda registrado como cargado
+        '''
+        result.addCounts(self.rowIndex.skippedCounts())
+        if not result and not self.dry_run:
+            self.rowIndex.addFile(hashValue)
+
+    def _sections(self, file, column_by_row = 0, samples = 0, chunk_size = None,
+                  commit_every = None, parse_in_process = False, reader = None,
+                  filter = True):
+        '''
+        Generador de las secciones del archivo: las hojas de un
+        WorkbookReader, una sola en los demás casos. Cada sección activa
+        sus reglas y es un generador de bloques (firstRow, records), que
+        pasan por _filter si filter.
+        La lectura del archivo empieza al pedir la primera sección
+        '''
+        # El bloque de proceso es el de la transacción si se pidió,
+        # si no el de lectura. Sin ninguno de los dos es un único bloque
+        size = commit_every or chunk_size
+        # Número de fila (desde 1) del primer récord de datos
+        firstRow = column_by_row + samples + 2
+        if reader is None:
+            reader = readerFor(file)
+        if parse_in_process:
+            if isinstance(reader, WorkbookReader):
+                raise Exception("parse_in_process doesn't support several sheets")
+            yield self._blocks(processChunks(file, column_by_row, samples,
+                                             size or DEFAULT_CHUNK_SIZE, reader),
+                               firstRow, filter)
+            return
+        if reader is None and chunk_size is None:
+            # Carga completa con pyexcel, como siempre
+            read = lambda: self._readSheet(file, column_by_row, samples)
+            if size is None:
+                chunks = self._wholeFile(read)
+            else:
+                chunks = chunkBlocks(read(), size)
+            yield self._blocks(chunks, firstRow, filter)
+            return
+        for name, models, records in (reader or XLSXReader()).sections(
+                file, column_by_row, samples):
+            self._activate(name, models)
+            if size is None:
+                chunks = self._wholeFile(lambda: records)
+            else:
+                chunks = chunkBlocks(records, size)
+            yield self._blocks(chunks, firstRow, filter)
+        self._activate(None, None)
+
+    def _wholeFile(self, read):
+        '''
+        Un único bloque con todos los récords, que quedan en self.records.
+        Sin filas de datos no hay bloque, como en la lectura por bloques
+        '''
+        self.records = next(chunkBlocks(read(), None))
+        if self.records:
+            yield self.records
+
+    def _blocks(self, chunks, firstRow, filter = True):
+        '''
+        Numera los bloques de una sección y mide el tiempo de lectura.
+        Con filter cada bloque pasa por _filter
+        '''
+        numbered = numberChunks(chunks, firstRow)
+        while True:
+            start = time.perf_counter()
+            block = next(numbered, None)
+            if block is None:
+                return
+            self.stats.add("parse", None, time.perf_counter() - start, len(block[1]))
+            self.stats.rows += len(block[1])
+            if filter:
+                yield from self._filter(block)
+            else:
+                yield block
+
+    def _filter(self, block):
+        '''
+        Tramos del bloque con las filas a procesar según rowIndex
+        (consulta la base de datos), o el bloque entero sin rowIndex
+        '''
+        if self.rowIndex is None:
+            return [block]
+        with self.stats.phase("lookup", rows = len(block[1])):
+            return self.rowIndex.filter(*block)
+
+    def _activate(self, sheet, models):
+        '''
+        Activa las reglas de models (todas si es None) para los bloques
+        siguientes. Las reglas que usan un modelo de la misma fila
+        (type model) tienen que estar en la misma hoja que él
+        '''
+        self.sheetName = sheet
+        if models is None:
+            self.activeRules = None
+            return
+        rules = [rule for rule in self.rules if rule.model in models]
+        for model in models:
+            if model not in [rule.model for rule in rules]:
+                raise Exception("{0} of sheet {1} has no rules".format(model, sheet))
+        for rule in rules:
+            for match in rule.matches:
+                if match.typeMatch == "model" and match.model not in models:
+                    raise Exception("{0} of sheet {1} needs {2}, it must be in the same sheet".format(
+                        rule.model, sheet, match.model))
+        self.activeRules = rules
+
+    def _sheetErrors(self, errores):
+        '''
+        Con varias hojas cada error indica la suya
+        '''
+        if self.sheetName is not None:
+            for error in errores:
+                error["sheet"] = self.sheetName
+
+    def _runChunk(self, records, firstRow, commit = False, check = None):
+        '''
+        Procesa un bloque, en su propia transacción si commit. check se
+        llama dentro de la transacción, así un UploadAborted la revierte.
+        Sin transacción, las filas guardadas a medias se reportan (ver KeptRows)
+        '''
+        transactional = commit and not self.dry_run
+        with self.atomic() if transactional else nullcontext():
+            if transactional:
+                erroresChunk, counts = self._processRows(records, firstRow)
+            else:
+                kept = KeptRows()
+                erroresChunk, counts = self._processChunk(records, firstRow, kept = kept)
+                self._addKept(erroresChunk, kept, firstRow)
+            if check is not None:
+                check(records, firstRow, erroresChunk)
+        return erroresChunk, counts
+
+    def _processRows(self, records, firstRow):
+        '''
+        _processChunk dentro de la transacción del bloque, con cada fila
+        completa o nada: si una fila falla en una regla pero otras reglas
+        ya guardaron sus objetos, el bloque vuelve a su savepoint y se
+        procesa de nuevo sin esa fila, que conserva sus errores
+        '''
+        exclude = set()
+        excluded = []
+        while True:
+            savepoints = [(alias, transaction.savepoint(using = alias))
+                          for alias in self.aliases()]
+            kept = KeptRows()
+            erroresChunk, counts = self._processChunk(records, firstRow, exclude, kept)
+            rows = kept.rows()
+            if not rows:
+                for alias, sid in savepoints:
+                    transaction.savepoint_commit(sid, using = alias)
+                break
+            for alias, sid in savepoints:
+                transaction.savepoint_rollback(sid, using = alias)
+            exclude.update(rows)
+            excluded.extend(x for x in erroresChunk if x["row"] - firstRow in rows)
+        erroresChunk = [x for x in erroresChunk if x["row"] - firstRow not in exclude]
+        erroresChunk.extend(excluded)
+        erroresChunk.sort(key = lambda x: x["row"])
+        return erroresChunk, counts
+
+    def _addKept(self, errores, kept, firstRow):
+        '''
+        Agrega a errores las filas de kept, salvo con dry_run
+        '''
+        if self.dry_run:
+            return
+        keptErrors = kept.errors(firstRow)
+        if keptErrors:
+            self._sheetErrors(keptErrors)
+            errores.extend(keptErrors)
+            errores.sort(key = lambda x: x["row"])
+
+    def _processParallel(self, blocks, workers, commit, check):
+        '''
+        Procesa los bloques en un pool de hilos, de a una ventana de
+        workers bloques para no leer más de lo que se puede procesar.
+        Devuelve los resultados en el orden de las filas
+        '''
+        if commit and not self.dry_run and \
+                any(rule.naturalKey for level in self.levels() for rule in level):
+            # Cada bloque es una transacción con todas sus reglas: con claves
+            # naturales una clave puede repetirse en otro bloque, así que
+            # los bloques van de a uno y en orden
+            for firstRow, records in blocks:
+                yield self._runChunk(records, firstRow, True, check)
+            return
+        with ThreadPoolExecutor(max_workers = workers) as pool:
+            for window in chunkRecords(blocks, workers):
+                if commit:
+                    # Cada bloque completo en su transacción, con check
+                    # adentro para que un UploadAborted la revierta
+                    futures = [pool.submit(inThread, self._runChunk, records, firstRow,
+                                           True, check)
+                               for firstRow, records in window]
+                    results = []
+                    for future in futures:
+                        try:
+                            results.append(future.result())
+                        except UploadAborted:
+                            results.append(None)
+                    if check.aborted is not None:
+                        raise check.abort([error for result in results if result is not None
+                                           for error in result[0]])
+                    yield from results
+                    continue
+                results = self._processWindow(window, pool)
+                for (firstRow, records), (erroresChunk, counts) in zip(window, results):
+                    check(records, firstRow, erroresChunk)
+                    yield erroresChunk, counts
+
+    def _processWindow(self, window, pool):
+        '''
+        Ejecuta las reglas nivel por nivel sobre una ventana de bloques:
+        todas las reglas de un nivel y todos sus bloques a la vez
+        '''
+        items = [{} for _ in window]
+        errores = [[] for _ in window]
+        counts = [{} for _ in window]
+        kept = [KeptRows() for _ in window]
+        levels = self.levels()
+        releases = self._releases(levels)
+        for n, level in enumerate(levels):
+            tasks = []
+            for rule in level:
+                if rule.naturalKey:
+                    # Con claves naturales los bloques dependen entre sí
+                    # (una clave puede aparecer en más de uno): van en orden
+                    tasks.append((rule, list(range(len(window)))))
+                else:
+                    tasks.extend((rule, [k]) for k in range(len(window)))
+            futures = [pool.submit(inThread, self._runRule, rule,
+                                   [(window[k][1], window[k][0], items[k]) for k in ks])
+                       for rule, ks in tasks]
+            # Los objetos se publican cuando termina el nivel completo
+            for (rule, ks), future in zip(tasks, futures):
+                for k, (objs, erroresRule, countsRule) in zip(ks, future.result()):
+                    items[k][rule.model] = objs
+                    errores[k].extend(erroresRule)
+                    counts[k][rule.model] = countsRule
+                    kept[k].add(rule.model, objs)
+            for itemsBlock in items:
+                self._release(itemsBlock, releases[n])
+        for k, erroresChunk in enumerate(errores):
+            erroresChunk.sort(key = lambda x: x["row"])
+            self._sheetErrors(erroresChunk)
+            self._addKept(erroresChunk, kept[k], window[k][0])
+        return list(zip(errores, counts))
+
+    def _runRule(self, rule, blocks, exclude = ()):
+        '''
+        Ejecuta una regla sobre varios bloques (records, firstRow, items)
+        '''
+        results = []
+        for records, firstRow, items in blocks:
+            counts = {}
+            objs, errores = rule.generateItems(
+                    records, items, bulk_save = self.bulk_save,
+                    firstRow = firstRow, cache = self.cache,
+                    batch_size = self.batch_size, counts = counts,
+                    dry_run = self.dry_run, stats = self.stats,
+                    exclude = exclude)
+            results.append((objs, errores, counts))
+        return results
+
+    def atomic(self):
+        '''
+        Transacción sobre todas las bases de datos en las que
+        escriben las reglas
+        '''
+        stack = ExitStack()
+        for alias in self.aliases():
+            stack.enter_context(transaction.atomic(using = alias))
+        return stack
+
+    def aliases(self):
+        '''
+        Bases de datos en las que escribe la carga, en orden
+        '''
+        aliases = set(rule.db for rule in self.rules)
+        if self.rowIndex is not None:
+            aliases.add(self.rowIndex.db)
+        return sorted(aliases)
+
+    def _readSheet(self, file, column_by_row = 0, samples = 0):
+        '''
+        Lectura completa del archivo con pyexcel. Las filas pasan por
+        rowsToRecords como en la lectura por bloques, así las filas
+        anteriores a la de los nombres de columna no son récords.
+        La hoja no se guarda en la instancia y sus filas se sueltan a
+        medida que se leen (ver drainRows)
+        '''
         try:
-            self.file = file
             content = file.read()
-            self.sheet = pyexcel.get_sheet(file_type = "xlsx", file_content = content)
+            sheet = pyexcel.get_sheet(file_type = "xlsx", file_content = content)
         except:
             raise Exception("Failed to load file")
-        self.sheet.name_columns_by_row(column_by_row)
-        records = self.sheet.to_records()
-        for i, record in enumerate(records):
-            # Acá viene la lógica de tipos
-            # if i > column_by_row:
-            values = list(record.values())
-            vacios = [x == "" for x in values]
-            if (vacios.count(True) == len(vacios)):
-                break
-            self.records.append(record)
-        # Ahora vamos a iterar por reglas de modelos
-        # con los datos de las reglas con sus respectivos
-        # modelos prioritarios
-        cont = 0;
-        currentIndex = -1
+        # get_internal_array no copia las filas, sheet.array sí
+        return rowsToRecords(drainRows(sheet.get_internal_array()),
+                             column_by_row, samples)
+
+    def _processChunk(self, records, firstRow = 1, exclude = (), kept = None):
+        '''
+        Ejecuta todas las reglas, según el orden de defineOrder,
+        sobre un bloque de récords. firstRow es el número de fila
+        del primer récord, para reportar errores. Las filas de exclude
+        (índices) no se guardan en ninguna regla.
+        kept, un KeptRows opcional, recibe los objetos de cada regla.
+        Devuelve los errores y los conteos por modelo
+        '''
         errores = []
-        while cont < len(self.rules):
-            # Probamos con todos las reglas con prioridad de index
-            # currentIndex. Inicia el bucle con 0
-            currentIndex += 1
-            for i, rule in enumerate(self.rules):
-                # Validar
-                if rule.order == currentIndex:
-                    objs, errores = rule.generateItems(self.records, self.saved_models)
-                    # Almacenar todos los objetos creados de ese modelo
-                    self.saved_models[rule.model] = objs
-                    cont += 1
-        return errores
+        counts = {}
+        # Objetos creados en este bloque por cada modelo
+        items = {}
+        levels = self.levels()
+        releases = self._releases(levels)
+        for n, level in enumerate(levels):
+            for rule in level:
+                [(objs, erroresRule, counts[rule.model])] = self._runRule(
+                        rule, [(records, firstRow, items)], exclude)
+                # Almacenar todos los objetos creados de ese modelo
+                items[rule.model] = objs
+                errores.extend(erroresRule)
+                if kept is not None:
+                    kept.add(rule.model, objs)
+            self._release(items, releases[n])
+        self.saved_models = items
+        errores.sort(key = lambda x: x["row"])
+        self._sheetErrors(errores)
+        return errores, counts
+
+    async def _aprocessChunk(self, records, firstRow = 1):
+        '''
+        Versión asíncrona de _processChunk. Las reglas de un nivel
+        corren una tras otra
+        '''
+        errores = []
+        counts = {}
+        items = {}
+        kept = KeptRows()
+        levels = self.levels()
+        releases = self._releases(levels)
+        for n, level in enumerate(levels):
+            for rule in level:
+                counts[rule.model] = {}
+                objs, erroresRule = await rule.agenerateItems(
+                        records, items, bulk_save = self.bulk_save,
+                        firstRow = firstRow, cache = self.cache,
+                        batch_size = self.batch_size, counts = counts[rule.model],
+                        dry_run = self.dry_run, stats = self.stats)
+                items[rule.model] = objs
+                errores.extend(erroresRule)
+                kept.add(rule.model, objs)
+            self._release(items, releases[n])
+        self.saved_models = items
+        errores.sort(key = lambda x: x["row"])
+        self._sheetErrors(errores)
+        self._addKept(errores, kept, firstRow)
+        return errores, counts
+
+    def _releases(self, levels):
+        '''
+        Por cada nivel, los modelos cuyos objetos ya no necesita
+        ninguna regla (type model) de los niveles siguientes
+        '''
+        last = {}
+        for n, level in enumerate(levels):
+            for rule in level:
+                last.setdefault(rule.model, n)
+                for match in rule.matches:
+                    if match.typeMatch == "model":
+                        last[match.model] = n
+        releases = [[] for _ in levels]
+        for model, n in last.items():
+            releases[n].append(model)
+        return releases
 
-    def loadRules(self, data, bulk_save=False):
+    def _release(self, items, models):
+        '''
+        Suelta los objetos de models apenas los usó la última regla que
+        depende de ellos, salvo con keep_objects
+        '''
+        if self.keep_objects:
+            return
+        for model in models:
+            items.pop(model, None)
+
+    def loadRules(self, data, bulk_save=False, batch_size = None):
         '''
         Acá vamos a ordenar el tema de la librería de la carga masiva.
         Así que:
@@ -78,6 +837,10 @@ class DjangoBulkXLSXUpload():
             - remoteAttribute: Atributo remoto que hay que buscar según el tipo de relación
             - value: Según el caso, asigna directamente el valor (type: fixed)
             - separator: Valor separador de relaciones múltiples
+        Con bulk_save cada modelo se guarda por bloque con bulk_create
+        (de a batch_size objetos por consulta) en el orden de defineOrder,
+        y las claves primarias generadas se asignan a las reglas que
+        dependen de él fila por fila
         '''
         for im, model in enumerate(data.keys()):
             # Hay que revisar por cada modelo por si hay saveKwargs
@@ -86,8 +849,14 @@ class DjangoBulkXLSXUpload():
             if isinstance(self.saveKwargs, dict):
                 if model in self.saveKwargs.keys():
                     reglas = self.saveKwargs[model]
+            if bulk_save and reglas is not None and not hasattr(model, BULK_SAVE_HOOK):
+                raise Exception("bulk_save no compatible con saveKwargs de {0} sin {1}".format(
+                    model, BULK_SAVE_HOOK))
+            naturalKey = None
+            if isinstance(self.naturalKeys, dict):
+                naturalKey = self.naturalKeys.get(model)
             values = data[model]
-            rule = UploadRule(model, saveKwargsRule = reglas)
+            rule = UploadRule(model, saveKwargsRule = reglas, naturalKey = naturalKey)
             for keyModel in values.keys():
                 # keymodel es el nombre del atributo
                 # Puede ser el nombre de la columna si es string
@@ -154,9 +923,6 @@ class DjangoBulkXLSXUpload():
                             typeMatch = "simple"
                             )
                 elif column.get('type') == 'model':
-                    # Check de carga masiva
-                    if bulk_save:
-                        raise Exception("bulk_save no compatible con type model")
                     # Validación de que el modelo esté antes:
                     indexModel = list(data.keys()).index(column.get('model'))
                     assert indexModel < im, "Modelo no referenciado antes"
@@ -169,11 +935,29 @@ class DjangoBulkXLSXUpload():
                             )
                 else:
                     raise Exception("Falta especificar bien el tipo")
+            rule.compile()
             self.rules.append(rule)
-        if len(self.rules) == 1 and bulk_save:
-            self.bulk_save = True
+        self.bulk_save = bulk_save
+        self.batch_size = batch_size
         self.defineOrder()
 
+    def checkBulkSupport(self):
+        '''
+        En bulk_save las reglas dependientes (type model) y las relaciones
+        ManyToManyField necesitan las claves primarias que devuelve
+        bulk_create, lo que no todas las bases de datos soportan
+        '''
+        referenced = set(match.model for rule in self.rules
+                         for match in rule.matches if match.typeMatch == "model")
+        for rule in self.rules:
+            if rule.model not in referenced and not rule.links:
+                continue
+            connection = connections[router.db_for_write(rule.model)]
+            if not connection.features.can_return_rows_from_bulk_insert:
+                raise Exception(
+                    "bulk_save de {0} necesita que la base de datos {1} devuelva "
+                    "las claves primarias en bulk_create".format(rule.model, connection.alias))
+
     def defineOrder(self):
         '''
         Definir el orden de guardado de cada modelo
@@ -189,7 +973,9 @@ class DjangoBulkXLSXUpload():
                 if isinstance(relation, ForeignKey):
                     # relation.name es el nombre del atributo del modelo vinculado
                     # y related_model es el modelo al que apunta
-                    if(relation.related_model in [x.model for x in self.rules]):
+                    # Las relaciones de un modelo consigo mismo no definen orden
+                    if(relation.related_model in [x.model for x in self.rules] and
+                       relation.related_model != modelDict["model"]):
                         modelDict["relations"].append({
                             "name": relation.name,
                             "related_model": relation.related_model
@@ -198,6 +984,8 @@ class DjangoBulkXLSXUpload():
         cont = 0
         order = 0
         while cont < len(modelsDep):
+            # Modelos que quedan en este nivel
+            ordered = []
             for modelDict in modelsDep:
                 index = modelDict["index"]
                 # La condición no es que la cantidad de relaciones sean cero,
@@ -206,222 +994,1726 @@ class DjangoBulkXLSXUpload():
                     # Si no hay relaciones, de una!
                     self.rules[index].order = order
                     self.rules[index]._ordered = True
-                    # Ahora, a limpiar referencias de ese modelo
-                    # en otros modelos
-                    for modelClean in modelsDep:
-                        cleanIndexes = [i for i, x in enumerate(modelClean["relations"])
-                                        if x["related_model"] == modelDict["model"]]
-                        # Ahora a borrarlos
-                        modelClean["relations"] = [x for i, x in enumerate(modelClean["relations"])
-                                                   if i not in cleanIndexes]
+                    ordered.append(modelDict["model"])
                     # Se pudo, entonces a aumentar cont
                     cont += 1
+            if not ordered:
+                raise Exception("Dependencias circulares entre los modelos de las reglas")
+            # Ahora, a limpiar referencias de esos modelos en otros modelos.
+            # Se hace al final de la pasada para que los que dependen de
+            # ellos queden en el nivel siguiente y no en el mismo
+            for modelClean in modelsDep:
+                modelClean["relations"] = [x for x in modelClean["relations"]
+                                           if x["related_model"] not in ordered]
             # Ya se hizo una iteración de modelos
             order += 1
 
+    def levels(self):
+        '''
+        Reglas agrupadas por nivel de dependencia (order),
+        de menor a mayor
+        '''
+        rules = self.rules if self.activeRules is None else self.activeRules
+        orders = sorted(set(rule.order for rule in rules))
+        return [[rule for rule in rules if rule.order == order]
+                for order in orders]
+
 
-class UploadRule():
+def fileHash(file):
     '''
-    Class for rules!
-    Cada regla está definida por:
-        - Un modelo de Django
-        - Este modelo tiene varias correspondencias de columnas
+    sha256 del contenido de un archivo abierto en modo binario
     '''
-    def __init__(self, model, saveKwargsRule: Union[Dict, None] = None):
-        self.model: models.Model = model
-        self.matches: list[Match] = []
-        self.order: int = 0
-        self._ordered = False
-        # objs será una lista de mapas con la estructura:
-        # {index: int, obj: obj | None}
-        self.objs = []
-        self.saveKwargsRule: Union[Dict, None] = saveKwargsRule
-        # itemsModel contendrá la lista de los items
-        # del modelo junto con sus tipos
-        self.itemsModel = []
-        for field in model._meta.fields:
-            self.itemsModel.append({
-                "name": field.attname,
-                "type": field.get_internal_type()
-                })
+    digest = hashlib.sha256()
+    for block in iter(lambda: file.read(1024 * 1024), b""):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def isEmptyRecord(record):
+    '''
+    Un récord está vacío cuando todas sus celdas son ""
+    '''
+    values = list(record.values())
+    vacios = [x == "" for x in values]
+    return vacios.count(True) == len(vacios)
+
+
+def rowsToRecords(rows, column_by_row = 0, samples = 0):
+    '''
+    Generator of records (dicts by column name) from an iterable of rows.
+    Same semantics as DjangoBulkXLSXUpload.load: column names are taken
+    from row column_by_row, samples rows are skipped after it and the
+    reading stops at the first empty row.
+    '''
+    rows = iter(rows)
+    header = None
+    for i, row in enumerate(rows):
+        if i == column_by_row:
+            header = ["" if x is None else x for x in row]
+            break
+    if header is None:
+        return
+    for i, row in enumerate(rows):
+        if i < samples:
+            continue
+        # Las celdas vacías de openpyxl vienen como None, pyexcel las
+        # entrega como "". En modo read-only (y en CSV) las filas pueden
+        # venir más cortas que la cabecera
+        values = ["" if x is None else x for x in row[:len(header)]]
+        values += [""] * (len(header) - len(values))
+        record = dict(zip(header, values))
+        if isEmptyRecord(record):
+            break
+        yield record
+
+
+def drainRows(rows):
+    '''
+    Recorre una lista de filas sacándolas de la lista, así cada fila
+    se libera apenas se usó y no al terminar toda la lectura
+    '''
+    rows.reverse()
+    while rows:
+        yield rows.pop()
+
+
+def openWorkbook(file):
+    try:
+        return openpyxl.load_workbook(file, read_only = True, data_only = True)
+    except:
+        raise Exception("Failed to load file")
 
-    def addMatch(self, nameCol = None, attribute = None, model = None, sep = None, remoteAttribute = None, localAttr = None, fields = None, typeMatch = None, fixedValue = None):
-        match = Match(
-                nameCol = nameCol,
-                attribute = attribute,
-                model = model,
-                sep = sep,
-                remoteAttribute = remoteAttribute,
-                localAttr = localAttr,
-                fields = fields,
-                typeMatch = typeMatch,
-                fixedValue = fixedValue)
-        self.matches.append(match)
 
-    def generateItems(self, records, items={}, bulk_save = False):
+def streamRecords(file, column_by_row = 0, samples = 0, sheet = 0):
+    '''
+    Generator of records of a sheet (index or name, the first one by
+    default) read with openpyxl in read-only mode. Only the current
+    row is kept in memory. See rowsToRecords
+    '''
+    workbook = openWorkbook(file)
+    try:
+        worksheet = workbook.worksheets[sheet] if isinstance(sheet, int) else workbook[sheet]
+        yield from rowsToRecords(worksheet.iter_rows(values_only = True),
+                                 column_by_row, samples)
+    finally:
+        workbook.close()
+
+
+class Reader(ABC):
+    '''
+    Base class of the readers of DjangoBulkXLSXUpload.load. A reader turns
+    a file into records, dicts by column name (see rowsToRecords), that
+    go through the same rules whatever the format. A new format only
+    needs records(); readers are pickled to be used with parse_in_process
+    '''
+    @abstractmethod
+    def records(self, file, column_by_row = 0, samples = 0):
         '''
-        Records son los récords del Excel
-        Items son los items de otros elementos ya guardados
-        que se necesitan para guardar al item nuevo
+        Iterable of the records of file
         '''
-        objs = []
-        errores = []
-        for i, record in enumerate(records):
+
+    def sections(self, file, column_by_row = 0, samples = 0):
+        '''
+        Generator of (sheet, models, records): the rules of models (all of
+        them if None) process the records of sheet. One section by default
+        '''
+        yield None, None, self.records(file, column_by_row, samples)
+
+    def signature(self):
+        '''
+        What the reader reads, part of the key of a file already
+        loaded with idempotent. By default its class and attributes
+        '''
+        return (type(self).__name__,
+                sorted((name, repr(value)) for name, value in vars(self).items()))
+
+
+class XLSXReader(Reader):
+    '''
+    Streaming reader of a sheet (index or name) of a XLSX workbook
+    '''
+    def __init__(self, sheet = 0):
+        self.sheet = sheet
+
+    def records(self, file, column_by_row = 0, samples = 0):
+        return streamRecords(file, column_by_row, samples, self.sheet)
+
+
+class CSVReader(Reader):
+    '''
+    Streaming reader of CSV files with the csv module. Every value is a
+    string, converted later to the type of its field. fmtparams go to
+    csv.reader, e.g. CSVReader(delimiter = "\\t") for TSV
+    '''
+    def __init__(self, encoding = "utf-8-sig", **fmtparams):
+        self.encoding = encoding
+        self.fmtparams = fmtparams
+
+    def records(self, file, column_by_row = 0, samples = 0):
+        if isinstance(file, str):
+            with open(file, newline = "", encoding = self.encoding) as lines:
+                yield from self._records(lines, column_by_row, samples)
+        elif isinstance(file, io.TextIOBase):
+            yield from self._records(file, column_by_row, samples)
+        else:
+            # Archivos binarios (como los subidos a Django): se
+            # decodifican línea por línea
+            yield from self._records(codecs.iterdecode(file, self.encoding),
+                                     column_by_row, samples)
+
+    def _records(self, lines, column_by_row, samples):
+        return rowsToRecords(csv.reader(lines, **self.fmtparams), column_by_row, samples)
+
+
+class WorkbookReader(Reader):
+    '''
+    Reader of several sheets of a XLSX workbook, which is opened once.
+    sheets maps each sheet name to the models whose rules process it,
+    in order: {"Categories": [Category], "Products": [Product, Stock]}.
+    Rules with a model match must be in the sheet of that model, and
+    errors have the sheet they belong to
+    '''
+    def __init__(self, sheets):
+        self.sheets = sheets
+
+    def records(self, file, column_by_row = 0, samples = 0):
+        raise Exception("WorkbookReader reads several sheets, use sections")
+
+    def sections(self, file, column_by_row = 0, samples = 0):
+        workbook = openWorkbook(file)
+        try:
+            for name, models in self.sheets.items():
+                if name not in workbook.sheetnames:
+                    raise Exception("Sheet {0} not found in the file".format(name))
+                yield name, list(models), rowsToRecords(
+                        workbook[name].iter_rows(values_only = True),
+                        column_by_row, samples)
+        finally:
+            workbook.close()
+
+
+# Lectores según la extensión del archivo
+READERS = {
+    ".csv": lambda: CSVReader(),
+    ".tsv": lambda: CSVReader(delimiter = "\t"),
+}
+
+
+def readerFor(file):
+    '''
+    Reader según la extensión del nombre del archivo, o None
+    (XLSX de una hoja)
+    '''
+    name = file if isinstance(file, str) else getattr(file, "name", None)
+    if not isinstance(name, str):
+        return None
+    factory = READERS.get(os.path.splitext(name)[1].lower())
+    return factory() if factory is not None else None
+
+
+def numberChunks(chunks, firstRow):
+    '''
+    Agrega a cada bloque el número de fila de su primer récord
+    '''
+    for records in chunks:
+        yield firstRow, records
+        firstRow += len(records)
+
+
+def inThread(func, *args):
+    '''
+    Ejecuta func en un hilo del pool y cierra al final las conexiones
+    a la base de datos que ese hilo haya abierto
+    '''
+    try:
+        return func(*args)
+    finally:
+        connections.close_all()
+
+
+def _parseWorker(source, column_by_row, samples, size, output, reader = None):
+    '''
+    Proceso lector de processChunks: manda los bloques por la cola,
+    None al terminar o el texto del error si falla
+    '''
+    try:
+        file = source if isinstance(source, str) else io.BytesIO(source)
+        records = (reader or XLSXReader()).records(file, column_by_row, samples)
+        for chunk in chunkBlocks(records, size):
+            output.put(chunk)
+        output.put(None)
+    except Exception as e:
+        output.put(str(e))
+
+
+def processChunks(file, column_by_row = 0, samples = 0, size = DEFAULT_CHUNK_SIZE,
+                  reader = None):
+    '''
+    Same as chunkRecords(reader.records(...)) but the file is parsed in
+    a separate process, so parsing overlaps with the database work.
+    The reader is a single sheet XLSXReader by default.
+    Files saved on disk (paths or uploads with temporary_file_path) are
+    opened by the other process, other files are sent as bytes.
+    The process is started with spawn, so a script calling it needs the
+    usual if __name__ == "__main__" guard
+    '''
+    if isinstance(file, str):
+        source = file
+    elif hasattr(file, "temporary_file_path"):
+        source = file.temporary_file_path()
+    else:
+        source = file.read()
+    context = multiprocessing.get_context("spawn")
+    # Cola acotada: el lector no se adelanta más de dos bloques
+    output = context.Queue(maxsize = 2)
+    process = context.Process(
+            target = _parseWorker,
+            args = (source, column_by_row, samples, size, output, reader),
+            daemon = True
+            )
+    process.start()
+    try:
+        while True:
             try:
-                modelCopy = deepcopy(self.model)
-                obj = modelCopy()
-                match: Match
-                asignacion = {}
-                for match in self.matches:
-                    try:
-                        assert(match.attribute in [x['name'] for x in self.itemsModel])
-                    except:
-                        if match.typeMatch != "manytomany":
-                            assert(match.attribute + "_id" in [x['name'] for x in self.itemsModel])
-                    value = None
-                    # La variable forAssignement se da para que el valor que se compute
-                    # se asignado directamente. De lo contrario, se hará con .add()
-                    # por ser de una relación ManyToManyField
-                    forAssignement = True
-                    if match.typeMatch == "array_hstore":
-                        # Acá la idea es añadir los fields al array
-                        # de atributos del objeto.atributo
-                        condNone = eval(f"obj.{match.attribute} is None")
-                        if condNone:
-                            exec(f"obj.{match.attribute} = []")
-                        # Hay que modificar fields para que no tome literalmente el valor
-                        # de {{value}}
-                        if match.fields != None:
-                            for key in match.fields.keys():
-                                field = match.fields[key]
-                                if type(field) == str:
-                                    if "{{column:" in field and "}}" in field:
-                                        column = field.replace("{{column:", "").replace("}}", "")
-                                        # match.fields[key] = record[column]
-                                        asignacion[key] = record[column]
-                                    else:
-                                        asignacion[key] = field
-                                else:
-                                    asignacion[key] = None
-                        txtExec = f'obj.{match.attribute}.append({asignacion})'
-                        exec(txtExec)
-                    elif match.typeMatch == "fixed":
-                        # Acá hay que asignar directamente una referencia o valor
-                        # TODO: El valor no pasarlo como texto!
-                        txtExec = f'obj.{match.attribute} = match.fixedValue'
-                        exec(txtExec)
-                        confirma = eval(f'obj.{match.attribute}')
-                    elif match.typeMatch == "model":
-                        # Asignación de modelo cargado
-                        # Buscar el anterior:
-                        # TODO: Por ahora está 0 pero luego pendiente añadir a la regla el índice
-                        txtExec = f"obj.{match.attribute} = items[match.model][0]"
-                        exec(txtExec)
-                    elif match.typeMatch == 'foreign':
-                        forAssignement = False
-                        modelForQuery = match.model
-                        # Ahora a buscar el item remoto
-
-                        txtQuery = '''modelForQuery.objects.get({0} = "{1}")'''.format(
-                                match.remoteAttribute,
-                                record[match.nameCol]
-                                )
-                        modelForeign = eval(txtQuery)
-                        # Ahora se puede relacionar
-                        txtExec = "obj.{0} = modelForeign".format(
-                                match.attribute,
-                                )
-                        exec(txtExec)
-                    elif match.typeMatch == 'manytomany':
-                        # Necesitamos guardar para que pueda existir la relación
-                        obj.save()
-                        # Primer caso especial, esto es de ManyToManyField
-                        # Values for search
-                        values = record[match.nameCol].split(match.sep)
-                        modelForQuery = match.model
-                        # manyModel = None
-                        for value in values:
-                            try:
-                                # Primero lo buscamos para que quede en manyModel
-                                txtQuery = '''modelForQuery.objects.filter({0} = "{1}").first()'''.format(
-                                            match.remoteAttribute,
-                                            value
-                                        )
-                                manyModel = eval(txtQuery)
-                                # Ahora tenemos que añadirlo
-                                txtExec = "obj.{0}.add(manyModel)".format(match.attribute)
-                                exec(txtExec)
-                            except Exception as er:
-                                pass
-                    elif match.typeMatch == "simple":
-                        value = record[match.nameCol]
-                        # Antes de la ejecución, vamos a confirmar si es un número y necesita un valor
-                        # para no pasarle valores que no son!
-                        itemModel_ = [x for x in self.itemsModel if x['name'] == match.attribute]
-                        itemModel = {}
-                        if len(itemModel_) > 0:
-                            itemModel = itemModel_[0]
-                        # Chequeo de tipos!
-                        noGrabar = False
-                        if itemModel.get("type") == "IntegerField":
-                            try:
-                                exec("int(value)")
-                            except:
-                                noGrabar = True
-                        toExec = '''obj.{0} = value'''.format(
-                            match.attribute
-                            )
-                        if forAssignement and not noGrabar:
-                            exec(toExec)
-                    else:
-                        # Esto creo que debe venir de items, enviando modelos desde
-                        # arriba
-                        value = items[match.model][i]
-                    
-                if not bulk_save:
-                    # Ahora vamos a utilizar las reglas!
-                    # La idea es que venga la columna de donde se va a leer la data
-                    # y el separador correspondiente.
-                    saveWithKw = False
-                    if isinstance(self.saveKwargsRule, dict):
-                        # column es la columna de donde se obtendrá la información de los campos
-                        # nameKwarg es el nombre del argumento que se enviará a save literalmente
-                        # Ej: uoms
-                        column = self.saveKwargsRule.get('column')
-                        nameKwarg = self.saveKwargsRule.get('nameKwarg')
-                        sep = self.saveKwargsRule.get('sep')
-                        if column and sep and nameKwarg:
-                            dataColumn = record.get(column)
-                            if dataColumn:
-                                saveWithKw = True
-                                txtExecSave = f'''obj.save({nameKwarg} = "{dataColumn}", sep = "{sep}")'''
-                                exec(txtExecSave)
-                    if not saveWithKw:
-                        obj.save()
-            except Exception as e:
-                raise Exception(e)
-                errores.append("Error: {0}".format(str(e)))
-                obj = None
-            objs.append(obj)
-        if bulk_save:
-            self.model.objects.bulk_create(objs)
-        return objs, errores
+                chunk = output.get(timeout = 1)
+            except queue.Empty:
+                if not process.is_alive():
+                    raise Exception("Failed to load file: parser process died")
+                continue
+            if chunk is None:
+                break
+            if isinstance(chunk, str):
+                raise Exception(chunk)
+            yield chunk
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+
+def chunkBlocks(records, size = None):
+    '''
+    Agrupa un iterable de récords en RecordBlock de a lo sumo size
+    filas, sin guardar los dicts. Sin size es un único bloque
+    '''
+    if size is not None and size < 1:
+        raise Exception("chunk_size must be greater than zero")
+    header = None
+    columns = []
+    rows = 0
+    for record in records:
+        if header is None:
+            header = list(record.keys())
+            columns = [[] for _ in header]
+        for name, column in zip(header, columns):
+            column.append(record.get(name, ""))
+        rows += 1
+        if rows == size:
+            yield RecordBlock(header, columns)
+            columns = [[] for _ in header]
+            rows = 0
+    if rows or size is None:
+        yield RecordBlock(header or (), columns)
+
+
+class RecordBlock():
+    '''
+    Block of records stored by column: one list of values per column and
+    the column names interned once for the whole block. It behaves as a
+    read-only list of records: indexing or iterating gives Record views
+    '''
+    __slots__ = ("header", "positions", "columns")
+
+    def __init__(self, header, columns):
+        self.header = tuple(sys.intern(x) if isinstance(x, str) else x for x in header)
+        self.positions = {name: i for i, name in enumerate(self.header)}
+        self.columns = columns
+
+    @classmethod
+    def fromRecords(cls, records):
+        return next(chunkBlocks(records, None))
+
+    def column(self, name):
+        '''
+        Lista de valores de una columna (KeyError si no existe)
+        '''
+        return self.columns[self.positions[name]]
+
+    def take(self, indices):
+        '''
+        Nuevo bloque con las filas de indices
+        '''
+        return RecordBlock(self.header, [[column[i] for i in indices]
+                                         for column in self.columns])
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(range(*index.indices(len(self))))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("RecordBlock index out of range")
+        return Record(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield Record(self, index)
 
     def __repr__(self):
-        return "Rule for {0} with {1} matches. Order {2}".format(
-                self.model,
-                len(self.matches),
-                self.order
-                )
+        return "RecordBlock of {0} rows and {1} columns".format(len(self), len(self.header))
 
-class Match():
+
+class Record(Mapping):
     '''
-    Match para columnas con atributos o con modelos (Foreign key)
-    También para relaciones de ManyToManyField de items ya almacenados
+    Read-only view of a row of a RecordBlock with the interface of a dict
     '''
-    def __init__(self, attribute, nameCol = None,
-                 model=None, sep=None, remoteAttribute = None,
-                 localAttr = None, fields = None, typeMatch=None,
+    __slots__ = ("block", "index")
+
+    def __init__(self, block, index):
+        self.block = block
+        self.index = index
+
+    def __getitem__(self, key):
+        return self.block.columns[self.block.positions[key]][self.index]
+
+    def __iter__(self):
+        return iter(self.block.header)
+
+    def __len__(self):
+        return len(self.block.header)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def columnOf(records, name):
+    '''
+    Valores de una columna del bloque: directo de un RecordBlock,
+    o récord por récord
+    '''
+    if isinstance(records, RecordBlock):
+        return records.column(name)
+    return [record[name] for record in records]
+
+
+def chunkRecords(records, size):
+    '''
+    Agrupa un iterable de récords en listas de a lo sumo size elementos
+    '''
+    if size < 1:
+        raise Exception("chunk_size must be greater than zero")
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class RowError(Exception):
+    '''
+    Error de una fila puntual: se reporta y la carga sigue con las demás
+    '''
+    def __init__(self, reason, row = None, column = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.row = row
+        self.column = column
+
+    def asDict(self):
+        return {"row": self.row, "column": self.column, "error": self.reason}
+
+
+class KeptRows():
+    '''
+    Filas de un bloque que fallaron en alguna regla mientras otras
+    reglas sí guardaron sus objetos. Con transacción esas filas se
+    revierten, sin ella se reportan
+    '''
+    def __init__(self):
+        self.failed = set()
+        self.saved = {}
+
+    def add(self, model, objs):
+        for i, obj in enumerate(objs):
+            if obj is None:
+                self.failed.add(i)
+            else:
+                self.saved.setdefault(i, []).append(model)
+
+    def rows(self):
+        '''
+        {índice: [modelos guardados]} de las filas guardadas a medias
+        '''
+        return {i: self.saved[i] for i in sorted(self.failed) if i in self.saved}
+
+    def errors(self, firstRow = 1):
+        return [RowError("{0} of this row was saved anyway".format(model.__name__),
+                         row = firstRow + i).asDict()
+                for i, models in self.rows().items() for model in models]
+
+
+class UploadResult(list):
+    '''
+    Resultado de load(): la lista de errores {row, column, error}
+    junto con counts, los conteos de filas por modelo:
+        {modelo: {"inserted": n, "updated": n, "unchanged": n}}
+    '''
+    def __init__(self, errors = (), counts = None, stats = None):
+        super().__init__(errors)
+        self.counts = {model: dict(values) for model, values in (counts or {}).items()}
+        # UploadStats de la carga, si se midió
+        self.stats = stats
+        # Con idempotent: el archivo ya se había cargado y no se leyó
+        self.skippedFile = False
+
+    def addCounts(self, counts):
+        for model, values in counts.items():
+            total = self.counts.setdefault(model, {})
+            for key, value in values.items():
+                total[key] = total.get(key, 0) + value
+
+
+class UploadStats():
+    '''
+    Per-phase instrumentation of a load, available as result.stats:
+        - parse: reading the workbook
+        - scan: converting the columns and building the objects of each rule
+        - lookup: resolving foreign and manytomany values and natural keys
+        - save: writing the objects and their manytomany relations
+    Each phase has the wall time, the rows processed, the SQL queries and,
+    only when tracemalloc is tracing, the peak of traced memory, in total
+    and by rule. With workers the time of the threads is added up and the
+    peak memory isn't measured: tracemalloc keeps a single peak for the
+    whole process, so the phases running at the same time would mix it.
+    If opentelemetry is installed each phase is also a tracing span
+    '''
+    def __init__(self):
+        self.rows = 0
+        self.seconds = 0.0
+        self.phases = {}
+        self.rules = {}
+        # Medir el pico de memoria (no con workers, ver arriba)
+        self.memory = True
+        self._lock = Lock()
+        self._tracer = trace.get_tracer(__name__) if trace is not None else None
+
+    @contextmanager
+    def phase(self, name, rule = None, rows = 0, queries = True):
+        '''
+        Mide lo que se ejecuta dentro del bloque with. Sin queries no
+        se cuentan las consultas (el ORM asíncrono las corre en otro hilo)
+        '''
+        count = [0]
+
+        def counter(execute, sql, params, many, context):
+            count[0] += 1
+            return execute(sql, params, many, context)
+
+        with ExitStack() as stack:
+            if self._tracer is not None:
+                span = stack.enter_context(self._tracer.start_as_current_span(
+                    "DjangoBulkXLSXUpload.{0}".format(name)))
+                span.set_attribute("rows", rows)
+                if rule is not None:
+                    span.set_attribute("model", rule.model._meta.label)
+            if queries:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(counter))
+            memory = self.memory and tracemalloc.is_tracing()
+            if memory:
+                tracemalloc.reset_peak()
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.add(name, rule, time.perf_counter() - start, rows,
+                         count[0] if queries else None,
+                         tracemalloc.get_traced_memory()[1] if memory else None)
+
+    def add(self, name, rule, seconds, rows = 0, queries = None, memory = None):
+        with self._lock:
+            entries = [self.phases.setdefault(name, self._entry())]
+            if rule is not None:
+                byRule = self.rules.setdefault(rule.model._meta.label, {})
+                entries.append(byRule.setdefault(name, self._entry()))
+            for entry in entries:
+                entry["seconds"] += seconds
+                entry["rows"] += rows
+                if queries is not None:
+                    entry["queries"] += queries
+                if memory is not None:
+                    entry["peak_memory"] = max(entry["peak_memory"] or 0, memory)
+
+    def _entry(self):
+        return {"seconds": 0.0, "rows": 0, "queries": 0, "peak_memory": None}
+
+    def asDict(self):
+        return {
+            "rows": self.rows,
+            "seconds": self.seconds,
+            "phases": {name: dict(entry) for name, entry in self.phases.items()},
+            "rules": {label: {name: dict(entry) for name, entry in phases.items()}
+                      for label, phases in self.rules.items()},
+            }
+
+    def __repr__(self):
+        return "UploadStats of {0} rows in {1:.3f}s: {2}".format(
+                self.rows, self.seconds,
+                ", ".join("{0} {1:.3f}s".format(name, entry["seconds"])
+                          for name, entry in self.phases.items()))
+
+
+def measure(stats, name, rule = None, rows = 0, queries = True):
+    '''
+    stats.phase, o nada si no hay stats
+    '''
+    if stats is None:
+        return nullcontext()
+    return stats.phase(name, rule, rows, queries)
+
+
+class ErrorRateCheck():
+    '''
+    Corte de la carga por max_error_rate: se llama con cada bloque
+    procesado y lanza UploadAborted con los errores acumulados en result.
+    Si no se corta, registra las filas del bloque en rowIndex.
+    Se puede llamar desde varios hilos: una vez cortada la carga, los
+    bloques siguientes también lanzan UploadAborted y se revierten
+    '''
+    def __init__(self, max_error_rate, result, rowIndex = None):
+        self.max_error_rate = max_error_rate
+        self.result = result
+        self.rowIndex = rowIndex
+        self.rows = set()
+        self.processed = 0
+        # (mensaje, errores del bloque) del corte, si lo hubo
+        self.aborted = None
+        self._lock = Lock()
+
+    def __call__(self, records, firstRow, erroresChunk):
+        with self._lock:
+            if self.aborted is not None:
+                raise self.abort()
+            self.processed += len(records)
+            self.rows.update(x["row"] for x in erroresChunk)
+            if self.max_error_rate is not None and \
+                    len(self.rows) > self.max_error_rate * self.processed:
+                self.aborted = ("Error rate over {0} at row {1}".format(
+                    self.max_error_rate, firstRow + len(records) - 1), erroresChunk)
+                raise self.abort()
+            if self.rowIndex is not None:
+                self.rowIndex.record(records, firstRow, erroresChunk)
+
+    def abort(self, committed = ()):
+        '''
+        UploadAborted del corte, con los errores de result, los de
+        committed (bloques confirmados en paralelo que todavía no están
+        en result) y los del bloque que cortó la carga
+        '''
+        message, erroresChunk = self.aborted
+        errores = sorted(list(committed) + list(erroresChunk), key = lambda x: x["row"])
+        return UploadAborted(message, UploadResult(self.result + errores, self.result.counts,
+                                                   self.result.stats))
+
+
+class UploadAborted(Exception):
+    '''
+    La carga se abortó por superar max_error_rate. errors tiene
+    los errores encontrados hasta ese momento
+    '''
+    def __init__(self, message, errors):
+        super().__init__(message)
+        self.errors = errors
+
+
+class RowIndex():
+    '''
+    Índice persistente de load(idempotent = True), por fingerprint de las
+    reglas: los archivos ya cargados sin errores y el hash del contenido
+    de la última fila cargada con cada clave natural. Una fila se saltea,
+    antes de convertir o buscar nada, si todas las reglas con naturalKeys
+    de su sección tienen guardado el mismo hash para su clave.
+    Necesita el paquete en INSTALLED_APPS
+    '''
+    def __init__(self, uploader):
+        from .models import UploadedFileHash, UploadedRowHash
+        self.uploader = uploader
+        self.fingerprint = uploader.fingerprint()
+        self.fileModel = UploadedFileHash
+        self.rowModel = UploadedRowHash
+        self.db = router.db_for_write(UploadedRowHash)
+        # {id(tramo): [(hash, [(modelo, hash de la clave)])]} de las
+        # filas a procesar, hasta que se registran
+        self.pending = {}
+        self.skipped = {}
+
+    def seenFile(self, hashValue):
+        return self.fileModel.objects.filter(
+                fingerprint = self.fingerprint, file_hash = hashValue).exists()
+
+    def addFile(self, hashValue):
+        self.fileModel.objects.get_or_create(
+                fingerprint = self.fingerprint, file_hash = hashValue)
+
+    def filter(self, firstRow, records):
+        '''
+        Separa las filas sin cambios desde la última carga. Devuelve los
+        tramos de filas seguidas a procesar como bloques (firstRow, records)
+        '''
+        rules = [rule for level in self.uploader.levels() for rule in level]
+        keyed = [rule for rule in rules if rule.naturalKey]
+        if not keyed or any(rule.keyColumns is None for rule in keyed):
+            return [(firstRow, records)]
+        hashes = [contentHash(repr(list(record.items()))) for record in records]
+        keys = [[(rule.model._meta.label, contentHash(rule.rawKeyOf(record)))
+                 for rule in keyed] for record in records]
+        stored = {}
+        for j, rule in enumerate(keyed):
+            label = rule.model._meta.label
+            for batch in batches(sorted(set(k[j][1] for k in keys))):
+                for key, value in self.rowModel.objects.filter(
+                        fingerprint = self.fingerprint, model = label,
+                        key_hash__in = batch).values_list("key_hash", "row_hash"):
+                    stored[(label, key)] = value
+        # Tramos como [primer índice, índices]
+        spans = []
+        for i in range(len(records)):
+            if all(stored.get(key) == hashes[i] for key in keys[i]):
+                for rule in rules:
+                    self.skipped[rule.model] = self.skipped.get(rule.model, 0) + 1
+            elif spans and spans[-1][1][-1] == i - 1:
+                spans[-1][1].append(i)
+            else:
+                spans.append((i, [i]))
+        runs = []
+        for start, indices in spans:
+            if isinstance(records, RecordBlock):
+                run = records.take(indices)
+            else:
+                run = [records[i] for i in indices]
+            # Las filas quedan pendientes hasta que se registran en record
+            self.pending[id(run)] = [(hashes[i], keys[i]) for i in indices]
+            runs.append((firstRow + start, run))
+        return runs
+
+    def record(self, records, firstRow, errores):
+        '''
+        Guarda el hash de las filas del bloque que se cargaron sin errores
+        '''
+        failed = set(error["row"] for error in errores)
+        objs = {}
+        entries = self.pending.pop(id(records), None) or []
+        for i, (hashValue, keys) in enumerate(entries):
+            if firstRow + i in failed or self.uploader.dry_run:
+                continue
+            for label, key in keys:
+                objs[(label, key)] = self.rowModel(
+                        fingerprint = self.fingerprint, model = label,
+                        key_hash = key, row_hash = hashValue)
+        if objs:
+            self.rowModel.objects.bulk_create(
+                    list(objs.values()), update_conflicts = True,
+                    unique_fields = ["fingerprint", "model", "key_hash"],
+                    update_fields = ["row_hash"])
+
+    def skippedCounts(self):
+        return {model: {"skipped": rows} for model, rows in self.skipped.items()}
+
+
+def contentHash(value):
+    return hashlib.sha1(value.encode()).hexdigest()
+
+
+class ForeignKeyCache():
+    '''
+    LRU cache of related instances for foreign matches, keyed by
+    (model, remoteAttribute, value). It can be shared between uploads so
+    hot reference tables (units, categories...) aren't queried again.
+        - maxsize: Maximum quantity of instances kept
+        - models: If given, only these models are cached
+    Instances are never invalidated: use it for tables that don't change
+    while the cache lives, or call clear()
+    '''
+    def __init__(self, maxsize = 10000, models = None):
+        self.maxsize = maxsize
+        self.models = set(models) if models is not None else None
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def accepts(self, model):
+        return self.models is None or model in self.models
+
+    def get(self, model, lookup, value):
+        key = (model, lookup, value)
+        with self._lock:
+            instance = self._data.get(key)
+            if instance is not None:
+                self._data.move_to_end(key)
+            return instance
+
+    def set(self, model, lookup, value, instance):
+        key = (model, lookup, value)
+        with self._lock:
+            self._data[key] = instance
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last = False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Marca de valores que coinciden con más de una instancia remota
+DUPLICATED = object()
+
+
+def remoteValue(instance, lookup):
+    '''
+    Valor de instance en lookup, siguiendo relaciones separadas por __
+    '''
+    value = instance
+    for attname in lookup.split("__"):
+        value = getattr(value, attname)
+    return value
+
+
+def batches(values, size = LOOKUP_BATCH_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+# Valor de celda vacía en un campo que no es de texto: no se asigna
+EMPTY = object()
+
+# Textos aceptados como booleanos, en minúscula
+TRUE_VALUES = {"1", "true", "t", "yes", "y", "si", "sí", "s", "x", "verdadero", "v"}
+FALSE_VALUES = {"0", "false", "f", "no", "n", "falso"}
+
+# Tipos internos de Django que guardan texto
+STRING_TYPES = {"CharField", "TextField", "SlugField", "EmailField",
+                "URLField", "FilePathField", "GenericIPAddressField"}
+
+
+def integerConverter(field, connection):
+    low, high = connection.ops.integer_field_range(field.get_internal_type())
+
+    def convert(value):
+        if isinstance(value, bool):
+            raise ValueError("{0} isn't an integer".format(value))
+        if isinstance(value, str):
+            value = value.strip()
+        try:
+            number = Decimal(str(value))
+        except InvalidOperation:
+            raise ValueError("{0} isn't an integer".format(value))
+        if not number.is_finite() or number != number.to_integral_value():
+            raise ValueError("{0} isn't an integer".format(value))
+        number = int(number)
+        if (low is not None and number < low) or (high is not None and number > high):
+            raise ValueError("{0} is out of range".format(number))
+        return number
+    return convert
+
+
+def floatConverter(field, connection):
+    def convert(value):
+        if isinstance(value, bool):
+            raise ValueError("{0} isn't a number".format(value))
+        try:
+            return float(str(value).strip())
+        except ValueError:
+            raise ValueError("{0} isn't a number".format(value))
+    return convert
+
+
+def decimalConverter(field, connection):
+    # Se redondea a decimal_places como hace Django al guardar
+    quantum = Decimal(1).scaleb(-field.decimal_places)
+    limit = Decimal(10) ** (field.max_digits - field.decimal_places)
+
+    def convert(value):
+        if isinstance(value, bool):
+            raise ValueError("{0} isn't a number".format(value))
+        try:
+            number = Decimal(str(value).strip())
+        except InvalidOperation:
+            raise ValueError("{0} isn't a number".format(value))
+        if not number.is_finite():
+            raise ValueError("{0} isn't a number".format(value))
+        number = number.quantize(quantum)
+        if abs(number) >= limit:
+            raise ValueError("{0} has more than {1} digits".format(value, field.max_digits))
+        return number
+    return convert
+
+
+def booleanConverter(field, connection):
+    def convert(value):
+        if isinstance(value, bool):
+            return value
+        text = str(value).strip().lower()
+        if text in TRUE_VALUES:
+            return True
+        if text in FALSE_VALUES:
+            return False
+        raise ValueError("{0} isn't a boolean".format(value))
+    return convert
+
+
+def parseFormats(text, formats, kind):
+    for fmt in formats:
+        try:
+            return datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    raise ValueError("{0} isn't a valid {1}".format(text, kind))
+
+
+def dateConverter(field, connection):
+    formats = get_format("DATE_INPUT_FORMATS")
+
+    def convert(value):
+        if isinstance(value, datetime.datetime):
+            return value.date()
+        if isinstance(value, datetime.date):
+            return value
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            # Número de serie de fecha de Excel
+            return from_excel(value).date()
+        text = str(value).strip()
+        parsed = parse_date(text)
+        if parsed is None:
+            # Fecha con hora, como escribe csv las fechas de openpyxl
+            try:
+                parsedTime = parse_datetime(text)
+            except ValueError:
+                parsedTime = None
+            parsed = parsedTime.date() if parsedTime is not None else None
+        return parsed or parseFormats(text, formats, "date").date()
+    return convert
+
+
+def dateTimeConverter(field, connection):
+    formats = list(get_format("DATETIME_INPUT_FORMATS")) + list(get_format("DATE_INPUT_FORMATS"))
+
+    def convert(value):
+        if isinstance(value, datetime.datetime):
+            pass
+        elif isinstance(value, datetime.date):
+            value = datetime.datetime.combine(value, datetime.time())
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = from_excel(value)
+        else:
+            text = str(value).strip()
+            value = parse_datetime(text) or parseFormats(text, formats, "datetime")
+        if settings.USE_TZ and timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
+    return convert
+
+
+def timeConverter(field, connection):
+    formats = get_format("TIME_INPUT_FORMATS")
+
+    def convert(value):
+        if isinstance(value, datetime.datetime):
+            return value.time()
+        if isinstance(value, datetime.time):
+            return value
+        text = str(value).strip()
+        return parse_time(text) or parseFormats(text, formats, "time").time()
+    return convert
+
+
+def stringConverter(field, connection):
+    maxLength = getattr(field, "max_length", None)
+
+    def convert(value):
+        value = str(value)
+        if maxLength is not None and len(value) > maxLength:
+            raise ValueError("{0} has more than {1} characters".format(value, maxLength))
+        return value
+    return convert
+
+
+def genericConverter(field, connection):
+    def convert(value):
+        return field.to_python(value)
+    return convert
+
+
+# Conversor por tipo interno de Django. Los que no están usan to_python del campo
+CONVERTERS = {
+    "IntegerField": integerConverter,
+    "BigIntegerField": integerConverter,
+    "SmallIntegerField": integerConverter,
+    "PositiveIntegerField": integerConverter,
+    "PositiveBigIntegerField": integerConverter,
+    "PositiveSmallIntegerField": integerConverter,
+    "FloatField": floatConverter,
+    "DecimalField": decimalConverter,
+    "BooleanField": booleanConverter,
+    "NullBooleanField": booleanConverter,
+    "DateField": dateConverter,
+    "DateTimeField": dateTimeConverter,
+    "TimeField": timeConverter,
+}
+for _type in STRING_TYPES:
+    CONVERTERS[_type] = stringConverter
+
+
+def converterFor(field, connection):
+    '''
+    Conversor de un valor de celda al tipo de field, con las validaciones
+    de choices. Lanza ValueError (o ValidationError) si no es válido
+    '''
+    convert = CONVERTERS.get(field.get_internal_type(), genericConverter)(field, connection)
+    if not field.choices:
+        return convert
+    # Se aceptan tanto las claves como las etiquetas de choices
+    keys = set(key for key, label in field.flatchoices)
+    labels = {str(label).strip().lower(): key for key, label in field.flatchoices}
+
+    def convertChoice(value):
+        label = str(value).strip().lower()
+        if label in labels:
+            return labels[label]
+        value = convert(value)
+        if value not in keys:
+            raise ValueError("{0} isn't a valid choice".format(value))
+        return value
+    return convertChoice
+
+
+def errorMessage(error):
+    if isinstance(error, ValidationError):
+        return "; ".join(error.messages)
+    if isinstance(error, InvalidOperation):
+        return "Invalid number"
+    return str(error)
+
+
+class UploadRule():
+    '''
+    Class for rules!
+    Cada regla está definida por:
+        - Un modelo de Django
+        - Este modelo tiene varias correspondencias de columnas
+    '''
+    def __init__(self, model, saveKwargsRule: Union[Dict, None] = None,
+                 naturalKey = None):
+        self.model: models.Model = model
+        # Atributos que identifican una fila existente (upsert)
+        self.naturalKey = tuple(naturalKey) if naturalKey else ()
+        self.matches: list[Match] = []
+        self.order: int = 0
+        self._ordered = False
+        # objs será una lista de mapas con la estructura:
+        # {index: int, obj: obj | None}
+        self.objs = []
+        self.saveKwargsRule: Union[Dict, None] = saveKwargsRule
+        # Plan precalculado por compile(): lista de (match, función de asignación)
+        self.plan = None
+        self.saver = None
+        self.fieldTypes: Dict[str, str] = {}
+        # itemsModel contendrá la lista de los items
+        # del modelo junto con sus tipos
+        self.itemsModel = []
+        for field in model._meta.fields:
+            self.itemsModel.append({
+                "name": field.attname,
+                "type": field.get_internal_type()
+                })
+
+    def addMatch(self, nameCol = None, attribute = None, model = None, sep = None, remoteAttribute = None, localAttr = None, fields = None, typeMatch = None, fixedValue = None):
+        match = Match(
+                nameCol = nameCol,
+                attribute = attribute,
+                model = model,
+                sep = sep,
+                remoteAttribute = remoteAttribute,
+                localAttr = localAttr,
+                fields = fields,
+                typeMatch = typeMatch,
+                fixedValue = fixedValue)
+        self.matches.append(match)
+
+    def compile(self):
+        '''
+        Precalcula el plan de carga de la regla: valida una sola vez los
+        atributos de cada Match contra el modelo y los convierte en funciones
+        de asignación. El plan se reutiliza en cada fila y en cada carga
+        que use estas mismas reglas
+        '''
+        self.fieldTypes = {x['name']: x['type'] for x in self.itemsModel}
+        plan = [(match, match.compile(self)) for match in self.matches]
+        # Las relaciones ManyToManyField no se asignan por fila: se enlazan
+        # en bloque con linkManyToMany una vez guardados los objetos
+        self.plan = [(match, assign) for match, assign in plan if assign is not None]
+        # Campos que asigna la regla, para comparar en el upsert
+        opts = self.model._meta
+        self.keyFields = [opts.get_field(name) for name in self.naturalKey]
+        self.updateFields = []
+        for match, assign in self.plan:
+            field = opts.get_field(match.attribute)
+            if field not in self.keyFields and not field.primary_key and \
+                    field not in self.updateFields:
+                self.updateFields.append(field)
+        self.links = [match for match in self.matches if match.typeMatch == "manytomany"]
+        self.keyColumns = self._compileKeyColumns()
+        self.saveKwargs = self._compileSaveKwargs()
+        self.saveKwargsValues = self._compileSaveKwargsValues()
+        # Con el hook del modelo los saveKwargs van en bloque (ver createWithHook)
+        self.bulkHook = None
+        if self.saveKwargsValues is not None:
+            self.bulkHook = getattr(self.model, BULK_SAVE_HOOK, None)
+        self.saver = self._compileSave()
+
+    def _compileKeyColumns(self):
+        '''
+        De dónde sale cada parte de la clave natural en el archivo, para
+        RowIndex: (columna, None) o (None, valor fijo). None si alguna
+        parte no sale de una columna simple, foreign o de un valor fijo
+        '''
+        if not self.naturalKey:
+            return None
+        parts = []
+        for field in self.keyFields:
+            match = None
+            for candidate in self.matches:
+                if candidate.attribute in (field.name, field.attname) and \
+                        candidate.typeMatch in ("simple", "foreign", "fixed"):
+                    match = candidate
+            if match is None:
+                return None
+            if match.typeMatch == "fixed":
+                parts.append((None, match.signature()[-1]))
+            else:
+                parts.append((match.nameCol, None))
+        return parts
+
+    def rawKeyOf(self, record):
+        '''
+        Clave natural de un récord tal como viene en el archivo,
+        antes de convertir ni buscar nada
+        '''
+        return repr(tuple(str(record.get(column)) if column is not None else value
+                          for column, value in self.keyColumns))
+
+    def _compileSave(self):
+        '''
+        Función de guardado de cada objeto según saveKwargsRule
+        '''
+        saveKwargs = self.saveKwargs
+        return lambda obj, record: obj.save(**saveKwargs(record))
+
+    def _compileSaveKwargs(self):
+        '''
+        Función que devuelve los argumentos extra de save() de
+        cada récord según saveKwargsRule
+        '''
+        if not isinstance(self.saveKwargsRule, dict):
+            return lambda record: {}
+        # column es la columna de donde se obtendrá la información de los campos
+        # nameKwarg es el nombre del argumento que se enviará a save literalmente
+        # Ej: uoms
+        column = self.saveKwargsRule.get('column')
+        nameKwarg = self.saveKwargsRule.get('nameKwarg')
+        sep = self.saveKwargsRule.get('sep')
+        if not (column and sep and nameKwarg):
+            return lambda record: {}
+
+        def saveKwargs(record):
+            dataColumn = record.get(column)
+            if dataColumn:
+                return {nameKwarg: str(dataColumn), "sep": str(sep)}
+            return {}
+        return saveKwargs
+
+    def _compileSaveKwargsValues(self):
+        '''
+        Función que devuelve los valores de saveKwargsRule de cada récord
+        ya separados, para el hook en bloque del modelo: {nameKwarg: [partes]},
+        o None si el récord no tiene valor. None si no hay saveKwargsRule
+        '''
+        if not isinstance(self.saveKwargsRule, dict):
+            return None
+        column = self.saveKwargsRule.get('column')
+        nameKwarg = self.saveKwargsRule.get('nameKwarg')
+        sep = self.saveKwargsRule.get('sep')
+        if not (column and sep and nameKwarg):
+            return None
+        sep = str(sep)
+
+        def saveKwargsValues(record):
+            dataColumn = record.get(column)
+            if not dataColumn:
+                return None
+            parts = [part.strip() for part in str(dataColumn).split(sep)]
+            return {nameKwarg: [part for part in parts if part]}
+        return saveKwargsValues
+
+    def prepare(self, records, cache = None, firstRow = 1, resolve = True):
+        '''
+        Valores precalculados del bloque por cada Match: las columnas de
+        tipo simple convertidas al tipo de su campo, columna por columna,
+        y los índices {valor: instancia} de las relaciones (si resolve).
+        Devuelve prepared, los errores de conversión y los índices de las
+        filas que los tienen
+        '''
+        prepared = {}
+        errores = []
+        invalid = set()
+        if records:
+            header = records[0].keys()
+            for match in self.matches:
+                if match.nameCol is not None and match.nameCol not in header:
+                    raise Exception("Column {0} not found in the file".format(match.nameCol))
+        for match in self.matches:
+            if match.typeMatch == "simple":
+                prepared[match], erroresColumn = match.coerce(records)
+                for i, reason in erroresColumn:
+                    errores.append(RowError(reason, row = firstRow + i,
+                                            column = match.nameCol).asDict())
+                    invalid.add(i)
+        if resolve:
+            self.resolve(records, prepared, cache)
+        return prepared, errores, invalid
+
+    def resolve(self, records, prepared, cache = None):
+        '''
+        Completa prepared con los índices de las relaciones del bloque
+        '''
+        for match in self.matches:
+            if match.typeMatch in ("foreign", "manytomany"):
+                prepared[match] = match.resolve(records, cache)
+
+    async def aresolve(self, records, prepared, cache = None):
+        for match in self.matches:
+            if match.typeMatch in ("foreign", "manytomany"):
+                prepared[match] = await match.aresolve(records, cache)
+
+    def manyToManyLinks(self, objs, records, prepared, firstRow = 1, dry_run = False):
+        '''
+        Filas de la tabla intermedia de cada relación ManyToManyField de
+        los objetos ya guardados, como [(through, filas)], y los errores de
+        los valores que no se pudieron resolver. Con dry_run solo se
+        buscan esos errores
+        '''
+        links = []
+        errores = []
+        for match in self.links:
+            field = self.model._meta.get_field(match.attribute)
+            through = field.remote_field.through
+            sourceName = through._meta.get_field(field.m2m_field_name()).attname
+            targetName = through._meta.get_field(field.m2m_reverse_field_name()).attname
+            # Relación simétrica del modelo consigo mismo: .add() crea
+            # también la fila inversa
+            symmetrical = field.remote_field.symmetrical and \
+                field.remote_field.model == self.model
+            index = prepared[match]
+            pairs = set()
+            for i, (obj, record) in enumerate(zip(objs, records)):
+                if obj is None:
+                    continue
+                for value in match.tokens(record):
+                    target = index.get(value)
+                    if target is None or target is DUPLICATED:
+                        reason = "does not exist" if target is None else "is duplicated"
+                        errores.append(RowError('{0} with {1} = "{2}" {3}'.format(
+                            match.model.__name__, match.remoteAttribute, value, reason),
+                            row = firstRow + i, column = match.nameCol).asDict())
+                        continue
+                    if dry_run:
+                        continue
+                    pairs.add((obj.pk, target.pk))
+                    if symmetrical:
+                        pairs.add((target.pk, obj.pk))
+            if pairs:
+                links.append((through, [through(**{sourceName: source, targetName: target})
+                                        for source, target in sorted(pairs)]))
+        return links, errores
+
+    def linkManyToMany(self, objs, records, prepared, firstRow = 1, dry_run = False):
+        '''
+        Crea las relaciones ManyToManyField de los objetos ya guardados
+        con un bulk_create por Match sobre la tabla intermedia.
+        Devuelve los errores de los valores que no se pudieron resolver.
+        Con dry_run solo se buscan esos errores
+        '''
+        links, errores = self.manyToManyLinks(objs, records, prepared, firstRow, dry_run)
+        for through, rows in links:
+            through.objects.bulk_create(rows, ignore_conflicts = True)
+        return errores
+
+    async def alinkManyToMany(self, objs, records, prepared, firstRow = 1):
+        links, errores = self.manyToManyLinks(objs, records, prepared, firstRow)
+        for through, rows in links:
+            await through.objects.abulk_create(rows, ignore_conflicts = True)
+        return errores
+
+    def generateItems(self, records, items={}, bulk_save = False, firstRow = 1,
+                      cache = None, batch_size = None, counts = None, dry_run = False,
+                      stats = None, exclude = ()):
+        '''
+        Records son los récords del Excel
+        Items son los items de otros elementos ya guardados
+        que se necesitan para guardar al item nuevo, alineados
+        por fila con records
+        firstRow es el número de fila del primer récord y cache un
+        ForeignKeyCache opcional para las relaciones
+        Con bulk_save todos los objetos se guardan con un solo bulk_create
+        (de a batch_size por consulta)
+        counts, si se pasa, se completa con las filas inserted,
+        updated y unchanged
+        Con dry_run los objetos se crean pero no se guardan, y counts
+        tiene las filas válidas (valid)
+        stats, un UploadStats opcional, recibe el tiempo de cada fase.
+        Las filas de exclude (índices) quedan en None sin error
+        '''
+        if self.plan is None:
+            self.compile()
+        rows = len(records)
+        with measure(stats, "scan", self, rows):
+            prepared, errores, invalid = self.prepare(records, cache, firstRow,
+                                                      resolve = False)
+            invalid.update(exclude)
+        with measure(stats, "lookup", self, rows):
+            self.resolve(records, prepared, cache)
+        with measure(stats, "scan", self):
+            objs, erroresBuild = self.buildObjects(records, items, prepared, firstRow, invalid)
+        errores.extend(erroresBuild)
+        if dry_run:
+            self.countRows(objs, {}, counts, dry_run = True)
+            if self.links:
+                with measure(stats, "lookup", self):
+                    errores.extend(self.linkManyToMany(objs, records, prepared, firstRow,
+                                                       dry_run = True))
+            return objs, errores
+        # updates: {índice de fila: campos cambiados} de las filas que ya existían
+        updates = {}
+        if self.naturalKey:
+            with measure(stats, "lookup", self):
+                updates, erroresKey = self.matchExisting(objs, firstRow)
+            errores.extend(erroresKey)
+        with measure(stats, "save", self, rows):
+            hooked = self.bulkHook is not None
+            if hooked:
+                # Los objetos nuevos se guardan junto con el hook del modelo
+                errores.extend(self.createWithHook(objs, records, firstRow, batch_size,
+                                                   bulk_save, skip = updates))
+            if bulk_save:
+                if not hooked:
+                    errores.extend(self.bulkCreate(objs, firstRow, batch_size, skip = updates))
+                errores.extend(self.bulkUpdate(objs, updates, firstRow, batch_size))
+            else:
+                errores.extend(self.saveObjects(objs, records, updates, firstRow,
+                                                inserts = not hooked))
+            self.countRows(objs, updates, counts)
+            if self.links:
+                errores.extend(self.linkManyToMany(objs, records, prepared, firstRow))
+        return objs, errores
+
+    async def agenerateItems(self, records, items={}, bulk_save = False, firstRow = 1,
+                             cache = None, batch_size = None, counts = None, dry_run = False,
+                             stats = None):
+        '''
+        Versión asíncrona de generateItems, con los métodos asíncronos del ORM.
+        Django no tiene transacciones asíncronas: una fila que falla se
+        descarta sola porque cada escritura se confirma por separado
+        '''
+        if self.plan is None:
+            self.compile()
+        rows = len(records)
+        with measure(stats, "scan", self, rows, queries = False):
+            prepared, errores, invalid = self.prepare(records, cache, firstRow,
+                                                      resolve = False)
+        with measure(stats, "lookup", self, rows, queries = False):
+            await self.aresolve(records, prepared, cache)
+        with measure(stats, "scan", self, queries = False):
+            objs, erroresBuild = self.buildObjects(records, items, prepared, firstRow, invalid)
+        errores.extend(erroresBuild)
+        if dry_run:
+            self.countRows(objs, {}, counts, dry_run = True)
+            if self.links:
+                errores.extend(self.manyToManyLinks(objs, records, prepared, firstRow,
+                                                    dry_run = True)[1])
+            return objs, errores
+        updates = {}
+        if self.naturalKey:
+            with measure(stats, "lookup", self, queries = False):
+                updates, erroresKey = await self.amatchExisting(objs, firstRow)
+            errores.extend(erroresKey)
+        with measure(stats, "save", self, rows, queries = False):
+            hooked = self.bulkHook is not None
+            if hooked:
+                # El hook necesita un savepoint: va con el ORM síncrono
+                errores.extend(await sync_to_async(self.createWithHook)(
+                    objs, records, firstRow, batch_size, bulk_save, updates))
+            if bulk_save:
+                if not hooked:
+                    errores.extend(await self.abulkCreate(objs, firstRow, batch_size,
+                                                          skip = updates))
+                errores.extend(await self.abulkUpdate(objs, updates, firstRow, batch_size))
+            else:
+                errores.extend(await self.asaveObjects(objs, records, updates, firstRow,
+                                                       inserts = not hooked))
+            self.countRows(objs, updates, counts)
+            if self.links:
+                errores.extend(await self.alinkManyToMany(objs, records, prepared, firstRow))
+        return objs, errores
+
+    def countRows(self, objs, updates, counts = None, dry_run = False):
+        '''
+        Completa counts con las filas inserted, updated y unchanged,
+        o solo valid con dry_run
+        '''
+        if counts is None:
+            return
+        if dry_run:
+            counts["valid"] = len([obj for obj in objs if obj is not None])
+            return
+        for key in ("inserted", "updated", "unchanged"):
+            counts.setdefault(key, 0)
+        for i, obj in enumerate(objs):
+            if obj is None:
+                continue
+            if i not in updates:
+                counts["inserted"] += 1
+            elif updates[i]:
+                counts["updated"] += 1
+            else:
+                counts["unchanged"] += 1
+
+    def buildObjects(self, records, items, prepared, firstRow = 1, invalid = ()):
+        '''
+        Crea (sin guardar) el objeto de cada récord aplicando el plan.
+        Las filas con error, y las de invalid, quedan en None
+        '''
+        objs = []
+        errores = []
+        for i, record in enumerate(records):
+            if i in invalid:
+                objs.append(None)
+                continue
+            match = None
+            try:
+                obj = self.model()
+                for match, assign in self.plan:
+                    assign(obj, record, items, i, prepared)
+            except RowError as e:
+                e.row = firstRow + i
+                errores.append(e.asDict())
+                obj = None
+            except Exception as e:
+                errores.append(RowError(str(e), row = firstRow + i,
+                                        column = match.nameCol if match else None).asDict())
+                obj = None
+            objs.append(obj)
+        return objs, errores
+
+    def naturalKeyOf(self, obj):
+        return tuple(field.to_python(getattr(obj, field.attname))
+                     for field in self.keyFields)
+
+    def naturalKeysOf(self, objs, firstRow = 1):
+        '''
+        {clave natural: índice} de los objetos del bloque. Las filas que
+        repiten una clave del mismo bloque quedan en None y con error
+        '''
+        keys = {}
+        errores = []
+        for i, obj in enumerate(objs):
+            if obj is None:
+                continue
+            key = self.naturalKeyOf(obj)
+            if key in keys:
+                errores.append(RowError("Natural key {0} repeated in row {1}".format(
+                    key, firstRow + keys[key]), row = firstRow + i).asDict())
+                objs[i] = None
+                continue
+            keys[key] = i
+        return keys, errores
+
+    def existingQueries(self, keys):
+        '''
+        Una consulta por lote de claves naturales
+        '''
+        manager = self.model._default_manager.using(self.db)
+        for batch in batches(keys):
+            if len(self.keyFields) == 1:
+                query = Q(**{"{0}__in".format(self.keyFields[0].attname): [x[0] for x in batch]})
+            else:
+                query = reduce(or_, [
+                    Q(**{field.attname: value for field, value in zip(self.keyFields, key)})
+                    for key in batch])
+            yield manager.filter(query)
+
+    def applyExisting(self, objs, keys, existing):
+        '''
+        Reemplaza en objs cada objeto que ya existe por la instancia
+        existente con los valores nuevos.
+        Devuelve {índice: campos cambiados} (vacío si no cambió nada)
+        '''
+        updates = {}
+        for key, i in keys.items():
+            instance = existing.get(key)
+            if instance is None:
+                continue
+            changed = []
+            for field in self.updateFields:
+                value = getattr(objs[i], field.attname)
+                if field.to_python(value) != field.to_python(getattr(instance, field.attname)):
+                    setattr(instance, field.attname, value)
+                    changed.append(field.attname)
+            objs[i] = instance
+            updates[i] = changed
+        return updates
+
+    def matchExisting(self, objs, firstRow = 1):
+        '''
+        Upsert: busca con una consulta por lote las filas que ya existen
+        con la misma clave natural (ver applyExisting).
+        Devuelve {índice: campos cambiados} y los errores de claves
+        repetidas en el mismo bloque
+        '''
+        keys, errores = self.naturalKeysOf(objs, firstRow)
+        existing = {}
+        for query in self.existingQueries(keys.keys()):
+            for instance in query:
+                existing[self.naturalKeyOf(instance)] = instance
+        return self.applyExisting(objs, keys, existing), errores
+
+    async def amatchExisting(self, objs, firstRow = 1):
+        keys, errores = self.naturalKeysOf(objs, firstRow)
+        existing = {}
+        for query in self.existingQueries(keys.keys()):
+            async for instance in query:
+                existing[self.naturalKeyOf(instance)] = instance
+        return self.applyExisting(objs, keys, existing), errores
+
+    def saveObjects(self, objs, records, updates = {}, firstRow = 1, inserts = True):
+        '''
+        Guardado de a un objeto. Dentro de una transacción cada fila va
+        en su savepoint para poder descartarla sola si falla.
+        Sin inserts solo se guardan las filas de updates
+        '''
+        savepoints = transaction.get_connection(self.db).in_atomic_block
+        errores = []
+        for i, obj in enumerate(objs):
+            if obj is None or updates.get(i) == [] or (not inserts and i not in updates):
+                continue
+            try:
+                with transaction.atomic(using = self.db) if savepoints else nullcontext():
+                    if i in updates:
+                        obj.save(update_fields = updates[i])
+                    else:
+                        self.saver(obj, records[i])
+            except Exception as e:
+                errores.append(RowError(str(e), row = firstRow + i).asDict())
+                objs[i] = None
+        return errores
+
+    async def asaveObjects(self, objs, records, updates = {}, firstRow = 1, inserts = True):
+        errores = []
+        for i, obj in enumerate(objs):
+            if obj is None or updates.get(i) == [] or (not inserts and i not in updates):
+                continue
+            try:
+                if i in updates:
+                    await obj.asave(update_fields = updates[i])
+                else:
+                    # asave no acepta los argumentos extra de saveKwargs:
+                    # el guardado compilado va fuera del loop
+                    await sync_to_async(self.saver)(obj, records[i])
+            except Exception as e:
+                errores.append(RowError(str(e), row = firstRow + i).asDict())
+                objs[i] = None
+        return errores
+
+    def createWithHook(self, objs, records, firstRow = 1, batch_size = None,
+                       bulk_save = False, skip = {}):
+        '''
+        Guarda objs (menos los índices de skip), con bulk_create si
+        bulk_save, y llama una sola vez al hook del modelo (BULK_SAVE_HOOK)
+        con los que tienen valor en la columna de saveKwargsRule y sus
+        valores ya separados, todo en un savepoint. Si algo falla se
+        revierte y cada fila se guarda con su hook en su propio savepoint
+        para encontrar las filas con error, que no quedan guardadas:
+        quedan en None dentro de objs y se devuelven como errores
+        '''
+        pending = [i for i, obj in enumerate(objs) if obj is not None and i not in skip]
+        if not pending:
+            return []
+        values = {i: self.saveKwargsValues(records[i]) for i in pending}
+        hooked = [i for i in pending if values[i] is not None]
+        # Como bulkCreate y saveObjects al volver de a una fila
+        force_insert = bool(bulk_save)
+        try:
+            with transaction.atomic(using = self.db):
+                if bulk_save:
+                    self.model.objects.bulk_create(
+                            [objs[i] for i in pending],
+                            batch_size = batch_size
+                            )
+                else:
+                    for i in pending:
+                        objs[i].save()
+                if hooked:
+                    self.bulkHook([objs[i] for i in hooked], [values[i] for i in hooked])
+            return []
+        except Exception:
+            pass
+        errores = []
+        for i in pending:
+            try:
+                with transaction.atomic(using = self.db):
+                    objs[i].save(force_insert = force_insert)
+                    if values[i] is not None:
+                        self.bulkHook([objs[i]], [values[i]])
+            except Exception as e:
+                errores.append(RowError(str(e), row = firstRow + i).asDict())
+                objs[i] = None
+        return errores
+
+    def bulkCreate(self, objs, firstRow = 1, batch_size = None, skip = {}):
+        '''
+        Guarda objs (menos los índices de skip) con bulk_create. Si falla,
+        se vuelve al guardado de a uno con un savepoint por fila para
+        encontrar las filas con error, que quedan en None dentro de objs
+        y se devuelven como errores
+        '''
+        pending = [i for i, obj in enumerate(objs) if obj is not None and i not in skip]
+        if not pending:
+            return []
+        try:
+            with transaction.atomic(using = self.db):
+                self.model.objects.bulk_create(
+                        [objs[i] for i in pending],
+                        batch_size = batch_size
+                        )
+            return []
+        except Exception:
+            pass
+        errores = []
+        for i in pending:
+            try:
+                with transaction.atomic(using = self.db):
+                    objs[i].save(force_insert = True)
+            except Exception as e:
+                errores.append(RowError(str(e), row = firstRow + i).asDict())
+                objs[i] = None
+        return errores
+
+    async def abulkCreate(self, objs, firstRow = 1, batch_size = None, skip = {}):
+        pending = [i for i, obj in enumerate(objs) if obj is not None and i not in skip]
+        if not pending:
+            return []
+        try:
+            await self.model.objects.abulk_create(
+                    [objs[i] for i in pending],
+                    batch_size = batch_size
+                    )
+            return []
+        except Exception:
+            pass
+        errores = []
+        for i in pending:
+            try:
+                await objs[i].asave(force_insert = True)
+            except Exception as e:
+                errores.append(RowError(str(e), row = firstRow + i).asDict())
+                objs[i] = None
+        return errores
+
+    def bulkUpdate(self, objs, updates, firstRow = 1, batch_size = None):
+        '''
+        Actualiza con bulk_update solo las filas existentes que cambiaron,
+        con el mismo respaldo de a una fila que bulkCreate
+        '''
+        pending = [i for i, fields in updates.items() if fields and objs[i] is not None]
+        if not pending:
+            return []
+        fields = sorted(set(name for i in pending for name in updates[i]))
+        try:
+            with transaction.atomic(using = self.db):
+                self.model.objects.bulk_update(
+                        [objs[i] for i in pending], fields,
+                        batch_size = batch_size
+                        )
+            return []
+        except Exception:
+            pass
+        errores = []
+        for i in pending:
+            try:
+                with transaction.atomic(using = self.db):
+                    objs[i].save(update_fields = updates[i])
+            except Exception as e:
+                errores.append(RowError(str(e), row = firstRow + i).asDict())
+                objs[i] = None
+        return errores
+
+    async def abulkUpdate(self, objs, updates, firstRow = 1, batch_size = None):
+        pending = [i for i, fields in updates.items() if fields and objs[i] is not None]
+        if not pending:
+            return []
+        fields = sorted(set(name for i in pending for name in updates[i]))
+        try:
+            await self.model.objects.abulk_update(
+                    [objs[i] for i in pending], fields,
+                    batch_size = batch_size
+                    )
+            return []
+        except Exception:
+            pass
+        errores = []
+        for i in pending:
+            try:
+                await objs[i].asave(update_fields = updates[i])
+            except Exception as e:
+                errores.append(RowError(str(e), row = firstRow + i).asDict())
+                objs[i] = None
+        return errores
+
+    @property
+    def db(self):
+        '''
+        Alias de la base de datos en la que se escribe el modelo
+        '''
+        return router.db_for_write(self.model)
+
+    def signature(self):
+        return (self.model._meta.label, self.naturalKey, repr(self.saveKwargsRule),
+                [match.signature() for match in self.matches])
+
+    def __repr__(self):
+        return "Rule for {0} with {1} matches. Order {2}".format(
+                self.model,
+                len(self.matches),
+                self.order
+                )
+
+class Match():
+    '''
+    Match para columnas con atributos o con modelos (Foreign key)
+    También para relaciones de ManyToManyField de items ya almacenados
+    '''
+    def __init__(self, attribute, nameCol = None,
+                 model=None, sep=None, remoteAttribute = None,
+                 localAttr = None, fields = None, typeMatch=None,
                  fixedValue = None):
         self.attribute = attribute
         self.nameCol = nameCol
@@ -433,6 +2725,216 @@ class Match():
         self.typeMatch = typeMatch
         self.fixedValue = fixedValue
 
+    def compile(self, rule):
+        '''
+        Valida el atributo contra el modelo de la regla y devuelve la
+        función que asigna el valor en cada fila:
+            assign(obj, record, items, i, prepared)
+        prepared tiene los valores de UploadRule.prepare de cada Match del bloque
+        '''
+        attribute = self.attribute
+        if self.typeMatch != "manytomany":
+            if attribute not in rule.fieldTypes and \
+                    "{0}_id".format(attribute) not in rule.fieldTypes:
+                raise Exception("{0} isn't an attribute of {1}".format(
+                    attribute, rule.model))
+        nameCol = self.nameCol
+        model = self.model
+        if self.typeMatch == "array_hstore":
+            # Hay que resolver fields para que no tome literalmente el valor
+            # de {{column:...}}: (clave, columna, valor fijo)
+            fields = []
+            if self.fields != None:
+                for key, field in self.fields.items():
+                    if type(field) == str:
+                        if "{{column:" in field and "}}" in field:
+                            column = field.replace("{{column:", "").replace("}}", "")
+                            fields.append((key, column, None))
+                        else:
+                            fields.append((key, None, field))
+                    else:
+                        fields.append((key, None, None))
+
+            def assign(obj, record, items, i, prepared):
+                # Acá la idea es añadir los fields al array
+                # de atributos del objeto.atributo
+                array = getattr(obj, attribute)
+                if array is None:
+                    array = []
+                    setattr(obj, attribute, array)
+                array.append({
+                    key: record[column] if column is not None else value
+                    for key, column, value in fields
+                    })
+        elif self.typeMatch == "fixed":
+            # Acá hay que asignar directamente una referencia o valor
+            fixedValue = self.fixedValue
+
+            def assign(obj, record, items, i, prepared):
+                setattr(obj, attribute, fixedValue)
+        elif self.typeMatch == "model":
+            # Asignación del modelo cargado en la misma fila
+            def assign(obj, record, items, i, prepared):
+                parent = items[model][i]
+                if parent is None:
+                    raise RowError("{0} of this row wasn't saved".format(model.__name__))
+                setattr(obj, attribute, parent)
+        elif self.typeMatch == "foreign":
+            lookup = self.remoteAttribute
+
+            def assign(obj, record, items, i, prepared):
+                # El item remoto ya viene resuelto en el índice del bloque
+                value = str(record[nameCol])
+                modelForeign = prepared[self].get(value)
+                if modelForeign is None:
+                    raise RowError('{0} with {1} = "{2}" does not exist'.format(
+                        model.__name__, lookup, value), column = nameCol)
+                if modelForeign is DUPLICATED:
+                    raise RowError('More than one {0} with {1} = "{2}"'.format(
+                        model.__name__, lookup, value), column = nameCol)
+                setattr(obj, attribute, modelForeign)
+        elif self.typeMatch == "manytomany":
+            # Se enlaza en UploadRule.linkManyToMany después de guardar
+            assign = None
+        elif self.typeMatch == "simple":
+            # Chequeo de tipos! Los valores de la columna ya vienen
+            # convertidos al tipo del campo en prepared (ver coerce)
+            field = rule.model._meta.get_field(attribute)
+            self.field = field
+            self.converter = converterFor(field, connections[rule.db])
+            self.isString = field.get_internal_type() in STRING_TYPES
+            self.required = not (field.null or field.has_default() or self.isString)
+
+            def assign(obj, record, items, i, prepared):
+                value = prepared[self][i]
+                if value is not EMPTY:
+                    setattr(obj, attribute, value)
+        else:
+            raise Exception("Falta especificar bien el tipo")
+        return assign
+
+    def coerce(self, records):
+        '''
+        Convierte la columna completa del bloque al tipo del campo.
+        Devuelve los valores (EMPTY para celdas vacías que no se asignan)
+        y los errores como (índice, motivo)
+        '''
+        convert = self.converter
+        values = []
+        errores = []
+        # Las columnas suelen repetir valores (fechas, booleanos, códigos):
+        # cada valor distinto se convierte una sola vez por bloque
+        converted = {}
+        for i, value in enumerate(columnOf(records, self.nameCol)):
+            if value is None or (value == "" and not self.isString):
+                if self.required:
+                    errores.append((i, "This field is required"))
+                values.append(EMPTY)
+                continue
+            key = (type(value), value)
+            if key in converted:
+                value, error = converted[key]
+            else:
+                try:
+                    value, error = convert(value), None
+                except (ValueError, TypeError, ArithmeticError, ValidationError) as e:
+                    value, error = EMPTY, errorMessage(e)
+                # Los valores mutables (JSON) no se comparten entre filas
+                if not isinstance(value, (list, dict, set)):
+                    converted[key] = (value, error)
+            if error is not None:
+                errores.append((i, error))
+            values.append(value)
+        return values, errores
+
+    def tokens(self, record):
+        '''
+        Valores a buscar en el modelo remoto para un récord: el de la
+        celda, o cada parte separada por sep en relaciones ManyToManyField
+        '''
+        return self.valueTokens(record[self.nameCol])
+
+    def valueTokens(self, value):
+        value = str(value)
+        if self.typeMatch == "manytomany":
+            return [x for x in value.split(self.sep) if x != ""]
+        return [value] if value != "" else []
+
+    def lookupValues(self, records, cache = None):
+        '''
+        Valores distintos del bloque que hay que buscar en el modelo remoto
+        y el índice con los que ya estaban en cache
+        '''
+        values = set()
+        for value in set(columnOf(records, self.nameCol)):
+            values.update(self.valueTokens(value))
+        index = {}
+        if cache is not None and cache.accepts(self.model):
+            for value in list(values):
+                instance = cache.get(self.model, self.remoteAttribute, value)
+                if instance is not None:
+                    index[value] = instance
+                    values.remove(value)
+        return values, index
+
+    def lookupQueries(self, values):
+        '''
+        Una consulta __in por lote de valores
+        '''
+        for batch in batches(sorted(values)):
+            yield self.model.objects.filter(
+                    **{"{0}__in".format(self.remoteAttribute): batch})
+
+    def addResolved(self, index, instance):
+        key = str(remoteValue(instance, self.remoteAttribute))
+        index[key] = DUPLICATED if key in index else instance
+
+    def cacheResolved(self, index, values, cache = None):
+        '''
+        Guarda en cache las instancias recién buscadas (no las repetidas)
+        '''
+        if cache is None or not cache.accepts(self.model):
+            return
+        for key, instance in index.items():
+            if instance is not DUPLICATED and key in values:
+                cache.set(self.model, self.remoteAttribute, key, instance)
+
+    def resolve(self, records, cache = None):
+        '''
+        Busca los valores distintos de la columna en el bloque con una
+        consulta __in por lote y devuelve el índice {valor: instancia}.
+        Los valores repetidos en el modelo remoto quedan como DUPLICATED
+        y los inexistentes no aparecen en el índice
+        '''
+        values, index = self.lookupValues(records, cache)
+        for query in self.lookupQueries(values):
+            for instance in query:
+                self.addResolved(index, instance)
+        self.cacheResolved(index, values, cache)
+        return index
+
+    async def aresolve(self, records, cache = None):
+        '''
+        Versión asíncrona de resolve
+        '''
+        values, index = self.lookupValues(records, cache)
+        for query in self.lookupQueries(values):
+            async for instance in query:
+                self.addResolved(index, instance)
+        self.cacheResolved(index, values, cache)
+        return index
+
+    def signature(self):
+        '''
+        Definición del Match como tupla comparable, para fingerprint
+        '''
+        fixedValue = self.fixedValue
+        if isinstance(fixedValue, models.Model):
+            fixedValue = (fixedValue._meta.label, fixedValue.pk)
+        return (self.typeMatch, self.attribute, self.nameCol,
+                self.model._meta.label if self.model is not None else None,
+                self.sep, self.remoteAttribute, repr(self.fields), repr(fixedValue))
+
     def __repr__(self):
         if self.nameCol:
             return "Match between {0} and column {1}".format(
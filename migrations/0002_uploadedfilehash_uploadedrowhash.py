@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_bulk_xlsx_upload', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadedFileHash',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('file_hash', models.CharField(max_length=64)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('fingerprint', 'file_hash')},
+            },
+        ),
+        migrations.CreateModel(
+            name='UploadedRowHash',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('model', models.CharField(max_length=100)),
+                ('key_hash', models.CharField(max_length=40)),
+                ('row_hash', models.CharField(max_length=40)),
+            ],
+            options={
+                'unique_together': {('fingerprint', 'model', 'key_hash')},
+            },
+        ),
+    ]
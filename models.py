@@ -0,0 +1,101 @@
+from django.apps import apps
+from django.db import models
+
+from .main import UploadResult
+
+
+class UploadJob(models.Model):
+    '''
+    Carga resumible de un archivo (ver DjangoBulkXLSXUpload.createJob
+    y DjangoBulkXLSXUpload.runJob). El avance queda en UploadJobChunk,
+    un registro por bloque confirmado
+    '''
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    )
+
+    # Ruta del archivo: tiene que seguir disponible para retomar la carga
+    file = models.CharField(max_length=1024)
+    file_hash = models.CharField(max_length=64)
+    rules_fingerprint = models.CharField(max_length=64)
+    # Argumentos de load (column_by_row, samples, commit_every, ...)
+    options = models.JSONField(default=dict)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    message = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "{0} ({1})".format(self.file, self.status)
+
+    def result(self):
+        '''
+        UploadResult con los errores y conteos de los bloques confirmados
+        '''
+        result = UploadResult()
+        for chunk in self.chunks.order_by("index"):
+            result.extend(chunk.errors)
+            result.addCounts({apps.get_model(label): counts
+                              for label, counts in chunk.counts.items()})
+        return result
+
+    def checkpoint(self):
+        '''
+        Último bloque confirmado por cada regla: {modelo: índice}
+        '''
+        last = {}
+        for chunk in self.chunks.order_by("index"):
+            for label in chunk.counts.keys():
+                last[apps.get_model(label)] = chunk.index
+        return last
+
+
+class UploadJobChunk(models.Model):
+    '''
+    Bloque confirmado de un UploadJob. Se guarda en la misma
+    transacción que las filas del bloque
+    '''
+    job = models.ForeignKey(UploadJob, on_delete=models.CASCADE, related_name="chunks")
+    index = models.PositiveIntegerField()
+    first_row = models.PositiveIntegerField()
+    rows = models.PositiveIntegerField()
+    errors = models.JSONField(default=list)
+    # Conteos por regla: {"app_label.Model": {inserted, updated, unchanged}}
+    counts = models.JSONField(default=dict)
+
+    class Meta:
+        unique_together = (("job", "index"),)
+        ordering = ("job", "index")
+
+
+class UploadedFileHash(models.Model):
+    '''
+    Archivo ya cargado sin errores con unas reglas (ver RowIndex)
+    '''
+    fingerprint = models.CharField(max_length=64)
+    file_hash = models.CharField(max_length=64)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = (("fingerprint", "file_hash"),)
+
+
+class UploadedRowHash(models.Model):
+    '''
+    Hash del contenido de la última fila cargada con cada clave
+    natural de un modelo, con unas reglas (ver RowIndex)
+    '''
+    fingerprint = models.CharField(max_length=64)
+    model = models.CharField(max_length=100)
+    key_hash = models.CharField(max_length=40)
+    row_hash = models.CharField(max_length=40)
+
+    class Meta:
+        unique_together = (("fingerprint", "model", "key_hash"),)
@@ -0,0 +1,25 @@
+'''
+Django para correr los tests con pytest, sin plugins:
+    python -m pytest tests
+La base de datos de test se crea una vez por sesión, como en el runner de Django
+'''
+import os
+import sys
+
+import django
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+django.setup()
+
+
+@pytest.fixture(scope = "session", autouse = True)
+def databases():
+    from django.test.utils import (setup_databases, setup_test_environment,
+                                   teardown_databases, teardown_test_environment)
+    setup_test_environment()
+    config = setup_databases(verbosity = 0, interactive = False)
+    yield
+    teardown_databases(config, verbosity = 0)
+    teardown_test_environment()
@@ -0,0 +1,63 @@
+'''
+Datos de los tests: las filas y las reglas de los benchmarks sobre benchapp
+'''
+import csv
+import importlib
+import io
+
+import openpyxl
+from django.conf import settings
+
+from benchapp.models import Category, Tag
+from generate import CATEGORIES, HEADER, TAGS, row
+from run import rules
+
+package = importlib.import_module(settings.PACKAGE)
+packageModels = importlib.import_module(settings.PACKAGE + ".models")
+
+UOMS = {"column": "uoms", "nameKwarg": "uoms", "sep": ","}
+
+
+def seed():
+    Category.objects.bulk_create([Category(name = "category{0}".format(i))
+                                  for i in range(CATEGORIES)])
+    Tag.objects.bulk_create([Tag(name = "tag{0}".format(i)) for i in range(TAGS)])
+
+
+def rows(quantity, start = 0):
+    return [row(i) for i in range(start, start + quantity)]
+
+
+def workbook(data, header = HEADER, sheets = None):
+    '''
+    Libro XLSX en memoria con data debajo de header, o con varias
+    hojas si se pasa sheets: {nombre: [header] + filas}
+    '''
+    book = openpyxl.Workbook()
+    if sheets is None:
+        sheets = {"Sheet": [header] + list(data)}
+    book.remove(book.active)
+    for name, sheetRows in sheets.items():
+        sheet = book.create_sheet(name)
+        for values in sheetRows:
+            sheet.append(values)
+    file = io.BytesIO()
+    book.save(file)
+    file.seek(0)
+    return file
+
+
+def csvExport(file):
+    '''
+    La primera hoja de un libro exportada a CSV con el módulo csv,
+    con los valores tal como los lee openpyxl
+    '''
+    sheet = openpyxl.load_workbook(file, read_only = True).worksheets[0]
+    text = io.StringIO()
+    csv.writer(text).writerows(sheet.iter_rows(values_only = True))
+    file.seek(0)
+    return io.BytesIO(text.getvalue().encode())
+
+
+def uploader(Product = None, **kwargs):
+    return package.DjangoBulkXLSXUpload(rules(Product), **kwargs)
@@ -0,0 +1,30 @@
+'''
+Settings de los tests: benchapp (el proyecto de los benchmarks) y el
+paquete sobre SQLite
+'''
+import os
+import sys
+import tempfile
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TESTS)
+sys.path[:0] = [os.path.dirname(ROOT), os.path.join(ROOT, "benchmarks")]
+
+# El paquete se importa con el nombre de su directorio, como en los benchmarks
+PACKAGE = os.path.basename(ROOT)
+
+SECRET_KEY = "tests"
+INSTALLED_APPS = ["benchapp", PACKAGE]
+# La base de test es un archivo para que los hilos de workers y de
+# sync_to_async la compartan; IMMEDIATE ordena sus escrituras
+DATABASES = {"default": {
+    "ENGINE": "django.db.backends.sqlite3",
+    "NAME": ":memory:",
+    "OPTIONS": {"transaction_mode": "IMMEDIATE", "timeout": 20},
+    "TEST": {"NAME": os.path.join(tempfile.gettempdir(), "bulk_upload_tests.sqlite3")},
+    }}
+# Las tablas del paquete salen de sus modelos: las migraciones
+# usan el label django_bulk_xlsx_upload
+MIGRATION_MODULES = {PACKAGE: None}
+USE_TZ = False
+DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
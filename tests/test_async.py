@@ -0,0 +1,70 @@
+from asgiref.sync import async_to_sync
+from django.test import TestCase
+
+from benchapp.models import BulkProduct, Product, Stock, Unit
+from helpers import UOMS, rows, seed, uploader, workbook
+
+
+async def collect(importer, file, **kwargs):
+    return [state["rows"] async for state in importer.aiterLoad(file, **kwargs)]
+
+
+class AsyncLoadTests(TestCase):
+    '''
+    async_to_sync corre las consultas de sync_to_async en el hilo del
+    test, dentro de su transacción
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        seed()
+
+    def test_aload(self):
+        blocks = []
+
+        async def progress(**state):
+            blocks.append(state["rows"])
+        data = rows(10)
+        data[6][2] = "many"
+        result = async_to_sync(uploader().aload)(workbook(data), chunk_size = 4,
+                                                  progress = progress)
+        self.assertEqual(sorted(set(x["row"] for x in result)), [8])
+        self.assertEqual(blocks, [4, 8, 10])
+        self.assertEqual(result.counts[Product]["inserted"], 9)
+        self.assertEqual(Stock.objects.count(), 9)
+        self.assertEqual(Product.tags.through.objects.count(), 18)
+
+    def test_aiterload(self):
+        states = async_to_sync(collect)(uploader(), workbook(rows(5)), chunk_size = 2)
+        self.assertEqual(states, [2, 4, 5])
+        self.assertEqual(Product.objects.count(), 5)
+
+    def test_save_kwargs_row_by_row(self):
+        result = async_to_sync(uploader(saveKwargs = {Product: UOMS}).aload)(
+                workbook(rows(3)))
+        self.assertEqual(list(result), [])
+        self.assertEqual(Stock.objects.count(), 3)
+        self.assertEqual(Unit.objects.count(), 6)
+
+    def test_save_kwargs_hook(self):
+        importer = uploader(BulkProduct, saveKwargs = {BulkProduct: UOMS}, bulk_save = True)
+        result = async_to_sync(importer.aload)(workbook(rows(3)), chunk_size = 2)
+        self.assertEqual(list(result), [])
+        self.assertEqual(Unit.objects.count(), 6)
+
+    def test_commit_every(self):
+        data = rows(10)
+        data[3][10] = "none"
+        result = async_to_sync(uploader().aload)(workbook(data), commit_every = 5)
+        self.assertEqual(sorted(set(x["row"] for x in result)), [5])
+        self.assertEqual(Product.objects.count(), 9)
+        self.assertEqual(Stock.objects.count(), 9)
+
+    def test_upsert(self):
+        importer = lambda: uploader(naturalKeys = {Product: ["sku"]})
+        async_to_sync(importer().aload)(workbook(rows(5)))
+        data = rows(7)
+        data[0][1] = "Renamed 0"
+        result = async_to_sync(importer().aload)(workbook(data))
+        self.assertEqual(result.counts[Product],
+                         {"inserted": 2, "updated": 1, "unchanged": 4})
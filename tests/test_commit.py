@@ -0,0 +1,48 @@
+from django.test import TestCase
+
+from benchapp.models import Product, Stock
+from helpers import package, rows, seed, uploader, workbook
+
+
+class CommitTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed()
+
+    def test_error_rate_rolls_back_current_block(self):
+        data = rows(100)
+        for i in range(50, 75):
+            data[i][2] = "many"
+        with self.assertRaises(package.UploadAborted) as aborted:
+            uploader().load(workbook(data), commit_every = 25, max_error_rate = 0.1)
+        self.assertEqual(len(set(x["row"] for x in aborted.exception.errors)), 25)
+        self.assertEqual(Product.objects.count(), 50)
+
+    def test_error_rate_without_commit_keeps_current_block(self):
+        data = rows(100)
+        for i in range(50, 60):
+            data[i][2] = "many"
+        with self.assertRaises(package.UploadAborted):
+            uploader().load(workbook(data), chunk_size = 25, max_error_rate = 0.1)
+        # El tercer bloque ya estaba escrito, menos sus filas con errores
+        self.assertEqual(Product.objects.count(), 65)
+
+    def test_failed_row_rolled_back_in_every_rule(self):
+        data = rows(30)
+        data[3][10] = "none"
+        data[17][10] = "none"
+        result = uploader().load(workbook(data), commit_every = 10)
+        self.assertEqual([x["row"] for x in result], [5, 19])
+        self.assertEqual(Product.objects.count(), 28)
+        self.assertEqual(Stock.objects.count(), 28)
+        self.assertFalse(Product.objects.filter(sku = data[3][0]).exists())
+
+    def test_kept_parents_reported_without_transaction(self):
+        data = rows(10)
+        data[3][10] = "none"
+        result = uploader().load(workbook(data))
+        self.assertEqual([x["error"] for x in result if x["row"] == 5][-1],
+                         "Product of this row was saved anyway")
+        self.assertEqual(Product.objects.count(), 10)
+        self.assertEqual(Stock.objects.count(), 9)
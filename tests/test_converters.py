@@ -0,0 +1,75 @@
+import datetime
+from decimal import Decimal
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+
+from benchapp.models import Product
+from helpers import package, rows, seed, uploader, workbook
+
+
+def converter(name):
+    return package.converterFor(Product._meta.get_field(name), connection)
+
+
+class ConverterTests(SimpleTestCase):
+
+    def assertInvalid(self, convert, value):
+        with self.assertRaises(ValueError):
+            convert(value)
+
+    def test_integer(self):
+        convert = converter("qty")
+        self.assertEqual(convert("12"), 12)
+        self.assertEqual(convert(12.0), 12)
+        self.assertInvalid(convert, "1.5")
+        self.assertInvalid(convert, True)
+        self.assertInvalid(convert, "x")
+
+    def test_decimal(self):
+        convert = converter("price")
+        self.assertEqual(convert("3.456"), Decimal("3.46"))
+        self.assertEqual(convert(7), Decimal("7.00"))
+        self.assertInvalid(convert, "abc")
+        self.assertInvalid(convert, "123456789")
+
+    def test_boolean(self):
+        convert = converter("active")
+        self.assertIs(convert("yes"), True)
+        self.assertIs(convert(" No "), False)
+        self.assertInvalid(convert, "maybe")
+
+    def test_date(self):
+        convert = converter("released")
+        expected = datetime.date(2020, 1, 1)
+        self.assertEqual(convert(expected), expected)
+        self.assertEqual(convert(datetime.datetime(2020, 1, 1, 10, 30)), expected)
+        self.assertEqual(convert("2020-01-01"), expected)
+        # Lo que escribe csv para una fecha leída con openpyxl
+        self.assertEqual(convert("2020-01-01 00:00:00"), expected)
+        # Número de serie de Excel
+        self.assertEqual(convert(43831), expected)
+        self.assertInvalid(convert, "2020-13-01 00:00:00")
+        self.assertInvalid(convert, "soon")
+
+    def test_max_length(self):
+        convert = converter("name")
+        self.assertEqual(convert(12), "12")
+        self.assertInvalid(convert, "x" * 101)
+
+
+class DryRunTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed()
+
+    def test_errors_by_row_and_column(self):
+        data = rows(5)
+        data[1][2] = "many"
+        data[3][5] = "someday"
+        result = uploader().load(workbook(data), dry_run = True)
+        self.assertEqual([(x["row"], x["column"]) for x in result if x["column"]],
+                         [(3, "qty"), (5, "released")])
+        self.assertEqual(result.counts[Product]["valid"], 3)
+        self.assertEqual(Product.objects.count(), 0)
@@ -0,0 +1,65 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from benchapp.models import Category, Product, Stock
+from helpers import package, rows, seed, uploader, workbook
+
+
+def lookups(queries, table):
+    return [x for x in queries if x["sql"].startswith("SELECT") and table in x["sql"]]
+
+
+class ForeignTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed()
+
+    def test_one_query_per_column_and_block(self):
+        with CaptureQueriesContext(connection) as queries:
+            result = uploader().load(workbook(rows(60)), chunk_size = 30)
+        self.assertEqual(list(result), [])
+        # Las 60 filas usan 50 categorías distintas
+        self.assertEqual(len(lookups(queries, '"benchapp_category"')), 2)
+        self.assertEqual(Product.objects.filter(category__name = "category7").count(), 2)
+
+    def test_missing_value(self):
+        data = rows(5)
+        data[2][6] = "nowhere"
+        result = uploader().load(workbook(data))
+        self.assertIn({"row": 4, "column": "category",
+                       "error": 'Category with name = "nowhere" does not exist'}, result)
+        self.assertEqual(Product.objects.count(), 4)
+
+    def test_duplicated_value(self):
+        category = Category.objects.first()
+        Product.objects.bulk_create([
+            Product(sku = "A", name = "Twin", qty = 1, price = 1, category = category),
+            Product(sku = "B", name = "Twin", qty = 1, price = 1, category = category),
+            Product(sku = "C", name = "Single", qty = 1, price = 1, category = category),
+            ])
+        importer = package.DjangoBulkXLSXUpload({Stock: {
+            "product": {"type": "foreign", "column": "name",
+                        "model": Product, "remoteAttribute": "name"},
+            "qty": {"type": "simple", "column": "qty"},
+            }})
+        result = importer.load(workbook([["Twin", 1], ["Single", 2]], header = ["name", "qty"]))
+        self.assertEqual(list(result), [{"row": 2, "column": "name",
+                                         "error": 'More than one Product with name = "Twin"'}])
+        self.assertEqual(list(Stock.objects.values_list("product__sku", flat = True)), ["C"])
+
+    def test_cache_shared_between_uploads(self):
+        cache = package.ForeignKeyCache(models = [Category])
+        uploader(cache = cache).load(workbook(rows(10)))
+        self.assertEqual(len(cache), 10)
+        with CaptureQueriesContext(connection) as queries:
+            result = uploader(cache = cache).load(workbook(rows(10, start = 10)))
+        self.assertEqual(list(result), [])
+        # category10 a category19 no estaban en cache: una consulta
+        self.assertEqual(len(lookups(queries, '"benchapp_category"')), 1)
+        # Las filas 50 a 59 usan category0 a category9, ya en cache
+        with CaptureQueriesContext(connection) as queries:
+            uploader(cache = cache).load(workbook(rows(10, start = 50)))
+        self.assertEqual(lookups(queries, '"benchapp_category"'), [])
+        self.assertEqual(len(cache), 20)
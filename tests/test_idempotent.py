@@ -0,0 +1,67 @@
+import io
+
+from django.test import TestCase
+
+from benchapp.models import Category, Product, Stock
+from helpers import HEADER, package, rows, rules, seed, uploader, workbook
+
+
+class IdempotentTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed()
+
+    def copies(self, file):
+        '''
+        Copias del mismo libro: openpyxl guarda la hora en el archivo,
+        así que dos libros con las mismas filas no tienen el mismo hash
+        '''
+        content = file.getvalue()
+        return lambda: io.BytesIO(content)
+
+    def load(self, file, **kwargs):
+        return uploader(naturalKeys = {Product: ["sku"]}).load(file, idempotent = True,
+                                                                **kwargs)
+
+    def test_same_file_is_skipped(self):
+        copy = self.copies(workbook(rows(10)))
+        first = self.load(copy())
+        self.assertFalse(first.skippedFile)
+        second = self.load(copy())
+        self.assertTrue(second.skippedFile)
+        self.assertEqual(Stock.objects.count(), 10)
+
+    def test_append_only_loads_new_rows(self):
+        self.load(workbook(rows(10)), chunk_size = 4)
+        data = rows(13)
+        data[2][1] = "Renamed 2"
+        result = self.load(workbook(data), chunk_size = 4)
+        self.assertFalse(result.skippedFile)
+        self.assertEqual(result.counts[Product],
+                         {"inserted": 3, "updated": 1, "unchanged": 0, "skipped": 9})
+        self.assertEqual(Stock.objects.count(), 14)
+
+    def test_read_options_are_part_of_the_file_key(self):
+        copy = self.copies(workbook(rows(10)))
+        self.load(copy(), samples = 2)
+        result = self.load(copy())
+        self.assertFalse(result.skippedFile)
+        self.assertEqual(result.counts[Product]["inserted"], 2)
+
+    def test_sheet_mapping_is_part_of_the_file_key(self):
+        sheets = {"Categories": [["name"], ["extra0"]], "Products": [HEADER] + rows(5)}
+        allRules = {Category: {"name": {"type": "simple", "column": "name"}}}
+        allRules.update(rules())
+        uploaderOf = lambda: package.DjangoBulkXLSXUpload(
+                allRules, naturalKeys = {Category: ["name"], Product: ["sku"]})
+        copy = self.copies(workbook(None, sheets = sheets))
+        first = uploaderOf().load(copy(), idempotent = True,
+                                  reader = package.WorkbookReader({"Categories": [Category]}))
+        self.assertEqual(Product.objects.count(), 0)
+        result = uploaderOf().load(
+                copy(), idempotent = True,
+                reader = package.WorkbookReader({"Categories": [Category],
+                                                 "Products": [Product, Stock]}))
+        self.assertFalse(first.skippedFile or result.skippedFile)
+        self.assertEqual(Product.objects.count(), 5)
@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from benchapp.models import Product, Stock
+from helpers import package, packageModels, rows, seed, uploader, workbook
+
+UploadJob = packageModels.UploadJob
+
+
+class Crash(Exception):
+    pass
+
+
+class JobTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "upload.xlsx")
+        with open(self.path, "wb") as file:
+            file.write(workbook(rows(35)).getvalue())
+
+    def test_resume_after_crash(self):
+        job = uploader().createJob(self.path, commit_every = 10)
+
+        def crash(**state):
+            if state["rows"] == 20:
+                raise Crash()
+        with self.assertRaises(Crash):
+            uploader().runJob(job, progress = crash)
+        job.refresh_from_db()
+        self.assertEqual(job.status, UploadJob.FAILED)
+        self.assertEqual(job.chunks.count(), 2)
+        self.assertEqual(job.checkpoint(), {Product: 1, Stock: 1})
+        self.assertEqual(Product.objects.count(), 20)
+        blocks = []
+        result = uploader().runJob(job.pk, progress = lambda **state: blocks.append(state["rows"]))
+        job.refresh_from_db()
+        self.assertEqual(job.status, UploadJob.DONE)
+        # Los bloques confirmados se leen pero no se vuelven a procesar
+        self.assertEqual(blocks, [30, 35])
+        self.assertEqual(Product.objects.count(), 35)
+        self.assertEqual(Stock.objects.count(), 35)
+        self.assertEqual(result.counts[Product]["inserted"], 35)
+        self.assertEqual(job.result().counts[Product]["inserted"], 35)
+
+    def test_rules_must_match(self):
+        job = uploader().createJob(self.path)
+        other = package.DjangoBulkXLSXUpload(
+                {Product: {"sku": {"type": "simple", "column": "sku"}}})
+        with self.assertRaises(Exception):
+            other.runJob(job)
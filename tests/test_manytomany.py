@@ -0,0 +1,44 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from benchapp.models import Product
+from helpers import rows, seed, uploader, workbook
+
+Through = Product.tags.through
+
+
+class ManyToManyTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed()
+
+    def test_through_rows(self):
+        data = rows(10)
+        # Un valor repetido en la celda se enlaza una sola vez
+        data[0][7] = "tag1,tag1,tag2"
+        with CaptureQueriesContext(connection) as queries:
+            result = uploader().load(workbook(data), chunk_size = 5)
+        self.assertEqual(list(result), [])
+        self.assertEqual(Through.objects.count(), 20)
+        first = Product.objects.get(sku = data[0][0])
+        self.assertEqual(sorted(first.tags.values_list("name", flat = True)),
+                         ["tag1", "tag2"])
+        inserts = [x for x in queries if x["sql"].startswith("INSERT") and
+                   Through._meta.db_table in x["sql"]]
+        # Un bulk_create de la tabla intermedia por bloque
+        self.assertEqual(len(inserts), 2)
+
+    def test_unresolved_tokens(self):
+        data = rows(3)
+        data[1][7] = "tag3,missing,tag4"
+        result = uploader().load(workbook(data))
+        self.assertEqual(list(result), [{
+            "row": 3, "column": "tags",
+            "error": 'Tag with name = "missing" does not exist'}])
+        # Los demás valores de la celda se enlazan igual
+        product = Product.objects.get(sku = data[1][0])
+        self.assertEqual(sorted(product.tags.values_list("name", flat = True)),
+                         ["tag3", "tag4"])
+        self.assertEqual(Through.objects.count(), 6)
@@ -0,0 +1,72 @@
+from django.test import TestCase, TransactionTestCase
+
+from benchapp.models import Product, Stock
+from helpers import rows, seed, uploader, workbook
+
+
+def broken(quantity):
+    '''
+    Filas con una cantidad inválida en las filas 5, 23 y 41 de la hoja
+    '''
+    data = rows(quantity)
+    for i in (3, 21, 39):
+        data[i][2] = "many"
+    return data
+
+
+class ParallelTests(TransactionTestCase):
+
+    def setUp(self):
+        seed()
+
+    def test_same_result_as_serial(self):
+        serial = uploader().load(workbook(broken(50)), chunk_size = 10)
+        Product.objects.all().delete()
+        parallel = uploader().load(workbook(broken(50)), chunk_size = 10, workers = 3)
+        self.assertEqual(list(parallel), list(serial))
+        self.assertEqual([x["row"] for x in parallel if x["column"]], [5, 23, 41])
+        self.assertEqual(parallel.counts, serial.counts)
+        self.assertEqual(Product.objects.count(), 47)
+        self.assertEqual(Stock.objects.count(), 47)
+
+    def test_commit_every(self):
+        data = broken(50)
+        data[30][10] = "none"
+        result = uploader().load(workbook(data), commit_every = 10, workers = 3)
+        self.assertEqual(sorted(set(x["row"] for x in result)), [5, 23, 32, 41])
+        # La fila 32 falla en Stock: su Product vuelve atrás con el bloque
+        self.assertEqual(Product.objects.count(), 46)
+        self.assertEqual(Stock.objects.count(), 46)
+
+    def test_natural_keys(self):
+        data = rows(40)
+        # Claves repetidas en bloques distintos
+        for i in range(30, 40):
+            data[i][0] = data[i - 30][0]
+        for commit_every in (None, 10):
+            Product.objects.all().delete()
+            result = uploader(naturalKeys = {Product: ["sku"]}).load(
+                    workbook(data), chunk_size = 10, commit_every = commit_every,
+                    workers = 3)
+            self.assertEqual(list(result), [])
+            self.assertEqual(result.counts[Product],
+                             {"inserted": 30, "updated": 10, "unchanged": 0})
+            self.assertEqual(Product.objects.count(), 30)
+
+
+class ParseInProcessTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed()
+
+    def test_same_result_as_in_process(self):
+        expected = uploader().load(workbook(broken(45)), chunk_size = 7)
+        Product.objects.all().delete()
+        blocks = []
+        result = uploader().load(workbook(broken(45)), chunk_size = 7, parse_in_process = True,
+                                 progress = lambda **state: blocks.append(state["rows"]))
+        self.assertEqual(list(result), list(expected))
+        self.assertEqual(result.counts, expected.counts)
+        self.assertEqual(blocks, [7, 14, 21, 28, 35, 42, 45])
+        self.assertEqual(Product.objects.count(), 42)
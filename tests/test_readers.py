@@ -0,0 +1,61 @@
+from django.test import TestCase
+
+from benchapp.models import Category, Product, Stock
+from helpers import HEADER, csvExport, package, rows, rules, seed, uploader, workbook
+
+
+class ReaderTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed()
+
+    def test_csv_export_loads_as_the_workbook(self):
+        file = workbook(rows(20))
+        result = uploader().load(csvExport(file), reader = package.CSVReader())
+        self.assertEqual(list(result), [])
+        self.assertEqual(result.counts[Product]["inserted"], 20)
+        loaded = {p.sku: p for p in Product.objects.all()}
+        for values in rows(20):
+            product = loaded[values[0]]
+            self.assertEqual(product.released, values[5])
+            self.assertEqual(product.tags.count(), 2)
+
+    def test_reader_needs_records(self):
+        class Incomplete(package.Reader):
+            pass
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+    def test_multi_sheet(self):
+        data = rows(6)
+        data[2][2] = "many"
+        file = workbook(None, sheets = {
+            "Categories": [["name"], ["extra0"], ["extra1"]],
+            "Products": [HEADER] + data,
+            })
+        allRules = {Category: {"name": {"type": "simple", "column": "name"}}}
+        allRules.update(rules())
+        reader = package.WorkbookReader({"Categories": [Category],
+                                         "Products": [Product, Stock]})
+        result = package.DjangoBulkXLSXUpload(allRules).load(file, reader = reader)
+        self.assertEqual(result.counts[Category]["inserted"], 2)
+        self.assertEqual(result.counts[Product]["inserted"], 5)
+        self.assertEqual(set(x["sheet"] for x in result), {"Products"})
+        self.assertTrue(Category.objects.filter(name = "extra1").exists())
+
+    def test_commit_every_without_chunk_size(self):
+        data = rows(100)
+        # La clave de la fila 75 en adelante repite la de 75 filas antes,
+        # en otro bloque de commit_every
+        for i in range(75, 100):
+            data[i][0] = data[i - 75][0]
+        blocks = []
+        result = uploader(naturalKeys = {Product: ["sku"]}).load(
+                workbook(data), commit_every = 25,
+                progress = lambda **state: blocks.append(state["rows"]))
+        self.assertEqual(list(result), [])
+        self.assertEqual(blocks, [25, 50, 75, 100])
+        self.assertEqual(result.counts[Product],
+                         {"inserted": 75, "updated": 25, "unchanged": 0})
+        self.assertEqual(Product.objects.count(), 75)
@@ -0,0 +1,110 @@
+import sys
+from collections.abc import Mapping
+
+from asgiref.sync import async_to_sync
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase
+
+from benchapp.models import Category, Product, Stock
+from helpers import HEADER, csvExport, package, rows, rules, seed, uploader, workbook
+
+
+class RecordBlockTests(SimpleTestCase):
+
+    def setUp(self):
+        self.block = package.RecordBlock.fromRecords(
+                [{"sku": "A", "qty": 1}, {"sku": "B", "qty": 2}, {"sku": "C", "qty": 3}])
+
+    def test_columns(self):
+        self.assertEqual(len(self.block), 3)
+        self.assertEqual(self.block.header, ("sku", "qty"))
+        self.assertEqual(self.block.column("qty"), [1, 2, 3])
+        with self.assertRaises(KeyError):
+            self.block.column("price")
+        # Los nombres de columna se internan una vez por bloque
+        self.assertIs(self.block.header[0], sys.intern("sku"))
+
+    def test_records(self):
+        record = self.block[1]
+        self.assertIsInstance(record, Mapping)
+        self.assertEqual(dict(record), {"sku": "B", "qty": 2})
+        self.assertEqual(record.get("price", ""), "")
+        self.assertEqual(self.block[-1]["sku"], "C")
+        self.assertEqual([x["sku"] for x in self.block], ["A", "B", "C"])
+        with self.assertRaises(IndexError):
+            self.block[3]
+        with self.assertRaises(TypeError):
+            record["sku"] = "Z"
+        # Las vistas no tienen __dict__
+        with self.assertRaises(AttributeError):
+            record.extra = True
+
+    def test_take(self):
+        taken = self.block.take([0, 2])
+        self.assertEqual([dict(x) for x in taken],
+                         [{"sku": "A", "qty": 1}, {"sku": "C", "qty": 3}])
+        self.assertEqual(self.block[1:].column("sku"), ["B", "C"])
+
+    def test_chunks(self):
+        records = ({"sku": str(i)} for i in range(5))
+        blocks = list(package.chunkBlocks(records, 2))
+        self.assertEqual([x.column("sku") for x in blocks], [["0", "1"], ["2", "3"], ["4"]])
+        self.assertEqual(list(package.chunkBlocks(iter(()), 2)), [])
+        self.assertEqual(len(package.RecordBlock.fromRecords([])), 0)
+
+
+class ReleaseTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed()
+
+    def test_objects_released(self):
+        importer = uploader()
+        self.assertEqual(importer._releases(importer.levels()), [[], [Product, Stock]])
+        importer.load(workbook(rows(5)))
+        self.assertEqual(importer.saved_models, {})
+
+    def test_released_after_the_last_rule_that_uses_them(self):
+        productRules = rules()
+        productRules[Product]["category"] = {"type": "model", "model": Category}
+        allRules = {Category: {"name": {"type": "simple", "column": "sku"}}}
+        allRules.update(productRules)
+        importer = package.DjangoBulkXLSXUpload(allRules)
+        # Las categorías se sueltan apenas las usa Product, antes de Stock
+        self.assertEqual(importer._releases(importer.levels()),
+                         [[], [Category], [Product, Stock]])
+        result = importer.load(workbook(rows(3)))
+        self.assertEqual(list(result), [])
+        self.assertEqual(Product.objects.filter(category__name = F("sku")).count(), 3)
+
+    def test_keep_objects(self):
+        importer = uploader()
+        importer.load(workbook(rows(5)), chunk_size = 3, keep_objects = True)
+        # Los objetos del último bloque
+        self.assertEqual([x.sku for x in importer.saved_models[Product]],
+                         [values[0] for values in rows(5)[3:]])
+        self.assertEqual(len(importer.saved_models[Stock]), 2)
+
+
+class EmptyFileTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed()
+
+    def test_header_without_rows(self):
+        for kwargs in ({}, {"chunk_size": 10}, {"commit_every": 10}, {"dry_run": True}):
+            result = uploader().load(workbook([]), **kwargs)
+            self.assertEqual(list(result), [])
+            self.assertEqual(result.stats.rows, 0)
+        result = uploader().load(csvExport(workbook([])), reader = package.CSVReader())
+        self.assertEqual(list(result), [])
+        result = async_to_sync(uploader().aload)(workbook([]))
+        self.assertEqual(list(result), [])
+        self.assertEqual(Product.objects.count(), 0)
+
+    def test_header_and_empty_rows(self):
+        result = uploader().load(workbook([[""] * len(HEADER)] + rows(2)))
+        self.assertEqual(list(result), [])
+        self.assertEqual(Product.objects.count(), 0)
@@ -0,0 +1,41 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from benchapp.models import BulkProduct, Product, Unit
+from helpers import UOMS, rows, seed, uploader, workbook
+
+
+class SaveKwargsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed()
+
+    def test_row_by_row_save(self):
+        result = uploader(saveKwargs = {Product: UOMS}).load(workbook(rows(5)))
+        self.assertEqual(list(result), [])
+        self.assertEqual(Unit.objects.count(), 10)
+
+    def test_bulk_hook(self):
+        result = uploader(BulkProduct, saveKwargs = {BulkProduct: UOMS},
+                          bulk_save = True).load(workbook(rows(5)), chunk_size = 2)
+        self.assertEqual(list(result), [])
+        self.assertEqual(Unit.objects.count(), 10)
+
+    def test_failed_hook_row_is_not_saved(self):
+        data = rows(5)
+        data[2][9] = "unit,broken"
+        hook = BulkProduct.bulk_save_kwargs
+
+        def failing(objs, values):
+            if any("broken" in value["uoms"] for value in values):
+                raise Exception("broken unit")
+            hook(objs, values)
+        with mock.patch.object(BulkProduct, "bulk_save_kwargs", failing):
+            result = uploader(BulkProduct, saveKwargs = {BulkProduct: UOMS},
+                              bulk_save = True).load(workbook(data), commit_every = 5)
+        self.assertEqual(sorted(set(x["row"] for x in result)), [4])
+        self.assertEqual(Product.objects.count(), 4)
+        self.assertEqual(Unit.objects.count(), 8)
+        self.assertFalse(Product.objects.filter(sku = data[2][0]).exists())
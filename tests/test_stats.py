@@ -0,0 +1,82 @@
+import tracemalloc
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from benchapp.models import Product
+from helpers import package, rows, seed, uploader, workbook
+
+
+class StatsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed()
+
+    def test_queries_by_phase_and_rule(self):
+        with CaptureQueriesContext(connection) as queries:
+            result = uploader(bulk_save = True).load(workbook(rows(10)), chunk_size = 5)
+        stats = result.stats.asDict()
+        self.assertEqual(stats["rows"], 10)
+        self.assertEqual(stats["phases"]["parse"]["queries"], 0)
+        self.assertEqual(stats["phases"]["scan"]["queries"], 0)
+        product = stats["rules"]["benchapp.Product"]
+        stock = stats["rules"]["benchapp.Stock"]
+        # Categorías y tags: una consulta de cada una por bloque
+        self.assertEqual(product["lookup"]["queries"], 4)
+        self.assertEqual(stock["lookup"]["queries"], 0)
+        self.assertEqual(product["save"]["rows"], 10)
+        self.assertGreater(stock["save"]["queries"], 0)
+        for name in ("scan", "lookup", "save"):
+            self.assertEqual(stats["phases"][name]["queries"],
+                             product[name]["queries"] + stock[name]["queries"])
+        self.assertLessEqual(sum(entry["queries"] for entry in stats["phases"].values()),
+                             len(queries))
+
+    def test_peak_memory_only_when_tracing(self):
+        result = uploader().load(workbook(rows(5)))
+        self.assertIsNone(result.stats.phases["save"]["peak_memory"])
+        tracemalloc.start()
+        try:
+            result = uploader().load(workbook(rows(5, start = 5)))
+        finally:
+            tracemalloc.stop()
+        self.assertGreater(result.stats.phases["save"]["peak_memory"], 0)
+
+    def test_chunk_processed_signal(self):
+        sent = []
+
+        def receiver(sender, uploader, rows, errors, result, stats, **kwargs):
+            sent.append((sender, uploader, rows, len(errors), len(result)))
+
+        package.chunk_processed.connect(receiver)
+        self.addCleanup(package.chunk_processed.disconnect, receiver)
+        data = rows(7)
+        data[1][2] = "many"
+        importer = uploader()
+        progress = []
+        importer.load(workbook(data), chunk_size = 3,
+                      progress = lambda **state: progress.append(state["rows"]))
+        self.assertEqual([x[:3] for x in sent],
+                         [(package.DjangoBulkXLSXUpload, importer, n) for n in (3, 6, 7)])
+        self.assertEqual(progress, [3, 6, 7])
+        # Los errores del bloque y los acumulados
+        self.assertEqual([x[3:] for x in sent], [(2, 2), (0, 2), (0, 2)])
+        self.assertEqual(Product.objects.count(), 6)
+
+
+class WorkerStatsTests(TransactionTestCase):
+
+    def setUp(self):
+        seed()
+
+    def test_no_peak_memory_with_workers(self):
+        tracemalloc.start()
+        try:
+            result = uploader().load(workbook(rows(20)), chunk_size = 5, workers = 2)
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(result.stats.rows, 20)
+        self.assertEqual(result.stats.phases["lookup"]["queries"], 8)
+        self.assertIsNone(result.stats.phases["save"]["peak_memory"])
@@ -0,0 +1,50 @@
+from django.test import TestCase
+
+from benchapp.models import Product
+from helpers import HEADER, rows, seed, uploader, workbook
+
+
+class StreamingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed()
+
+    def titled(self, data):
+        '''
+        Libro con un título y una fila vacía antes de los nombres de columna
+        '''
+        return workbook(None, sheets = {"Sheet": [["Price list"], []] + [HEADER] + data})
+
+    def assertSameLoad(self, data, **kwargs):
+        results = []
+        for chunk_size in (None, 3):
+            Product.objects.all().delete()
+            result = uploader().load(self.titled(data), column_by_row = 2,
+                                     chunk_size = chunk_size, **kwargs)
+            results.append(([(x["row"], x["column"]) for x in result],
+                            result.counts[Product]["inserted"],
+                            sorted(Product.objects.values_list("sku", flat = True))))
+        self.assertEqual(results[0], results[1])
+        return results[0]
+
+    def test_rows_above_the_header(self):
+        errors, inserted, skus = self.assertSameLoad(rows(7))
+        self.assertEqual(errors, [])
+        self.assertEqual(inserted, 7)
+        self.assertEqual(skus, [values[0] for values in rows(7)])
+
+    def test_row_numbers(self):
+        data = rows(7)
+        data[4][2] = "many"
+        errors, inserted, skus = self.assertSameLoad(data, samples = 1)
+        # Título, vacía, cabecera, una de muestra: la quinta fila de
+        # datos es la 8 de la hoja
+        self.assertEqual(sorted(set(row for row, column in errors)), [8])
+        self.assertIn((8, "qty"), errors)
+        self.assertEqual(inserted, 5)
+
+    def test_stops_at_the_first_empty_row(self):
+        data = rows(3) + [[""] * len(HEADER)] + rows(2, start = 3)
+        errors, inserted, skus = self.assertSameLoad(data)
+        self.assertEqual(inserted, 3)
@@ -0,0 +1,42 @@
+from django.test import TestCase
+
+from benchapp.models import Product, Stock
+from helpers import rows, seed, uploader, workbook
+
+
+class UpsertTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        seed()
+
+    def assertCounts(self, bulk_save):
+        first = uploader(naturalKeys = {Product: ["sku"]}, bulk_save = bulk_save)
+        result = first.load(workbook(rows(10)), chunk_size = 4)
+        self.assertEqual(result.counts[Product],
+                         {"inserted": 10, "updated": 0, "unchanged": 0})
+        data = rows(13)
+        data[1][1] = "Renamed 1"
+        data[6][3] = "999.99"
+        second = uploader(naturalKeys = {Product: ["sku"]}, bulk_save = bulk_save)
+        result = second.load(workbook(data), chunk_size = 4)
+        self.assertEqual(list(result), [])
+        self.assertEqual(result.counts[Product],
+                         {"inserted": 3, "updated": 2, "unchanged": 8})
+        self.assertEqual(Product.objects.count(), 13)
+        self.assertEqual(Product.objects.get(sku = data[1][0]).name, "Renamed 1")
+        # Stock no tiene clave natural: cada carga inserta
+        self.assertEqual(Stock.objects.count(), 23)
+
+    def test_row_by_row(self):
+        self.assertCounts(False)
+
+    def test_bulk_save(self):
+        self.assertCounts(True)
+
+    def test_repeated_key_in_block(self):
+        data = rows(4)
+        data[3][0] = data[1][0]
+        result = uploader(naturalKeys = {Product: ["sku"]}).load(workbook(data))
+        self.assertEqual(sorted(set(x["row"] for x in result)), [5])
+        self.assertEqual(Product.objects.count(), 3)